@@ -1,5 +1,6 @@
 #!/usr/bin/env python3
 
+import os
 from flask import Flask
 from flask_sqlalchemy import SQLAlchemy
 from flask_bcrypt import Bcrypt
@@ -10,6 +11,106 @@ app = Flask(__name__)
 
 app.config['SECRET_KEY'] = '66532a62c4048f976e22a39638b6f10e'
 app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///site.db'
+
+# seconds a robot connection can sit unused before behavior control is handed
+# back to the robot, and before it is disconnected (None keeps it open)
+app.config['ROBOT_CONTROL_IDLE_TIMEOUT'] = 10
+app.config['ROBOT_DISCONNECT_IDLE_TIMEOUT'] = None
+
+# after ROBOT_BREAKER_THRESHOLD failed connection attempts a robot is treated
+# as unreachable without trying again, and probed in the background every
+# ROBOT_BREAKER_BACKOFF seconds, doubling up to ROBOT_BREAKER_MAX_BACKOFF
+app.config['ROBOT_BREAKER_THRESHOLD'] = 1
+app.config['ROBOT_BREAKER_BACKOFF'] = 5
+app.config['ROBOT_BREAKER_MAX_BACKOFF'] = 300
+
+# how long the web app waits for a robot that an application is driving
+# before giving up on taking behavior control of it
+app.config['ROBOT_CLAIM_TIMEOUT'] = 30
+
+# seconds between background refreshes of the status table
+app.config['STATUS_POLL_INTERVAL'] = 15
+
+# how many robots in the fleet are polled at the same time
+app.config['FLEET_POLL_WORKERS'] = 8
+
+# how many robots a broadcast command batch runs on at the same time
+app.config['FLEET_COMMAND_WORKERS'] = 8
+
+# status history: raw samples are kept for TELEMETRY_RAW_RETENTION seconds,
+# then rolled up into TELEMETRY_BUCKET_SECONDS wide min/max/avg buckets which
+# are kept for TELEMETRY_ROLLUP_RETENTION seconds
+app.config['TELEMETRY_RAW_RETENTION'] = 60 * 60 * 24
+app.config['TELEMETRY_BUCKET_SECONDS'] = 60 * 5
+app.config['TELEMETRY_ROLLUP_RETENTION'] = 60 * 60 * 24 * 30
+
+# frames per second the remote control camera stream is encoded at, and how
+# long the encoder keeps running after the last viewer has gone
+app.config['CAMERA_STREAM_FPS'] = 30
+app.config['CAMERA_STREAM_IDLE_TIMEOUT'] = 5
+
+# camera stream codec: JPEG, WEBP (sent to browsers that accept it, JPEG to
+# the rest) or PNG, with the chroma subsampling of JPEG
+app.config['CAMERA_STREAM_FORMAT'] = 'JPEG'
+app.config['CAMERA_STREAM_SUBSAMPLING'] = '4:2:0'
+
+# (scale, quality) steps of the adaptive camera stream, best first. Every
+# viewer starts on the first one and moves down a step while its connection
+# can't keep up with CAMERA_STREAM_FPS, and back up once it can.
+app.config['CAMERA_STREAM_LEVELS'] = [(1.0, 70), (0.75, 60), (0.5, 50),
+                                      (0.5, 30)]
+
+# how many times a second the remote control page's latest input is turned
+# into motor commands, however fast the input arrives
+app.config['CONTROL_LOOP_RATE'] = 30
+
+# where the animation list of each robot OS version is cached
+app.config['ANIMATION_CACHE_FOLDER'] = os.path.join(app.root_path, 'cache')
+
+# seconds a remote control session (and its hold on the robot) is kept after
+# the last page using it has closed
+app.config['CONTROL_SESSION_IDLE_TIMEOUT'] = 60
+
+# how many animations / say_text actions the remote control page can queue,
+# and what happens to a new one when the queue is full: 'drop_oldest' or
+# 'drop_newest'
+app.config['ACTION_QUEUE_SIZE'] = 10
+app.config['ACTION_QUEUE_OVERFLOW'] = 'drop_oldest'
+
+# camera recording: while a remote control session is open, keep the last
+# CAMERA_RECORDING_SEGMENTS * CAMERA_RECORDING_SEGMENT_SECONDS seconds of the
+# camera in CAMERA_RECORDING_SEGMENTS files of CAMERA_RECORDING_SEGMENT_BYTES
+# each, under one folder per robot
+app.config['CAMERA_RECORDING'] = False
+app.config['CAMERA_RECORDING_FOLDER'] = os.path.join(app.root_path,
+                                                     'recordings')
+app.config['CAMERA_RECORDING_SEGMENTS'] = 10
+app.config['CAMERA_RECORDING_SEGMENT_BYTES'] = 16 * 1024 * 1024
+app.config['CAMERA_RECORDING_SEGMENT_SECONDS'] = 60
+
+# warm interpreters kept waiting, with the SDK imported, to run applications
+app.config['APP_POOL_SIZE'] = 2
+
+# how often background applications are checked on (and their exits reaped),
+# and how long one gets to exit after being stopped before it is killed
+app.config['APP_HEARTBEAT_INTERVAL'] = 1
+app.config['APP_STOP_TIMEOUT'] = 5
+
+# where the output of each application's last run is kept, and how many of
+# its lines are kept in memory for following a run live
+app.config['APP_LOG_FOLDER'] = os.path.join(app.root_path, 'app_logs')
+app.config['APP_LOG_TAIL'] = 500
+
+# a scheduled run more than APP_SCHEDULE_MISFIRE_GRACE seconds late counts as
+# missed, and a run waiting for the last one to finish checks again every
+# APP_SCHEDULE_RETRY_INTERVAL seconds
+app.config['APP_SCHEDULE_MISFIRE_GRACE'] = 60
+app.config['APP_SCHEDULE_RETRY_INTERVAL'] = 10
+
+# threads running queued robot jobs (dock, undock, staged commands...), and
+# how many finished jobs are kept around for /job/<id>
+app.config['JOB_WORKERS'] = 2
+app.config['JOB_HISTORY'] = 50
 db = SQLAlchemy(app)
 bcrypt = Bcrypt(app)
 login_manager = LoginManager(app)
@@ -4,8 +4,8 @@ import os
 from flask import render_template, url_for, redirect, Blueprint, flash,\
     request, send_file
 from vectorcloud import db
-from vectorcloud.models import Status, ApplicationStore, Application, Settings
-from vectorcloud.main.utils import get_stats
+from vectorcloud.models import ApplicationStore, Application, Settings
+from vectorcloud.main.utils import get_stats, current_status
 from vectorcloud.main.routes import sdk_version
 from vectorcloud.application_store.forms import UploadPackage, AdminAdd
 from vectorcloud.main.forms import SearchForm
@@ -38,7 +38,7 @@ def app_store():
     if err_msg:
         return redirect(url_for('error_pages.' + err_msg))
 
-    vector_status = Status.query.first()
+    vector_status = current_status()
 
     search_form = SearchForm()
     settings = Settings.query.first()
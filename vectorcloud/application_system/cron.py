@@ -0,0 +1,112 @@
+#!/usr/bin/env python3
+
+from datetime import datetime, timedelta
+
+
+# the five fields of a cron expression and the values each can take: minute,
+# hour, day of the month, month, day of the week (0 or 7 is Sunday)
+fields = (('minute', 0, 59),
+          ('hour', 0, 23),
+          ('day of the month', 1, 31),
+          ('month', 1, 12),
+          ('day of the week', 0, 7))
+
+# how far ahead next_after() looks before deciding an expression never
+# matches (e.g. "0 0 30 2 *")
+search_limit = timedelta(days=5 * 366)
+
+
+class CronError(ValueError):
+    pass
+
+
+# parse_field(): the set of values one field matches. Each comma separated
+# part is *, a value or a range (1-5), optionally with a step (*/15, 1-5/2,
+# 5/15 meaning from 5 up).
+def parse_field(text, name, low, high):
+    values = set()
+
+    for part in text.split(','):
+        step = 1
+        stepped = '/' in part
+        if stepped:
+            part, step = part.split('/', 1)
+
+        try:
+            step = int(step)
+            if part == '*':
+                start, end = low, high
+            elif '-' in part:
+                start, end = [int(value) for value in part.split('-', 1)]
+            else:
+                start = int(part)
+                end = high if stepped else start
+
+        except ValueError:
+            raise CronError('Bad %s field: %s' % (name, text))
+
+        if step < 1 or not low <= start <= end <= high:
+            raise CronError('Bad %s field: %s' % (name, text))
+
+        values.update(range(start, end + 1, step))
+
+    return frozenset(values)
+
+
+# ------------------------------------------------------------------------------
+# Cron expression
+# ------------------------------------------------------------------------------
+
+# a standard five field cron expression, in local time. Like cron, when both
+# day fields are restricted a day matching either of them matches.
+class CronExpression:
+
+    def __init__(self, text):
+        parts = text.split()
+        if len(parts) != len(fields):
+            raise CronError('A cron expression has 5 fields: '
+                            'minute hour day month weekday')
+
+        self.text = text
+        self.minutes, self.hours, self.days, self.months, weekdays = \
+            [parse_field(part, *field) for part, field in zip(parts, fields)]
+        self.weekdays = frozenset(day % 7 for day in weekdays)
+        self.any_day = parts[2] == '*'
+        self.any_weekday = parts[4] == '*'
+
+    def matches_day(self, moment):
+        day = moment.day in self.days
+        weekday = (moment.weekday() + 1) % 7 in self.weekdays
+
+        if self.any_day or self.any_weekday:
+            return day and weekday
+        return day or weekday
+
+    # next_after(): the first matching minute after timestamp, as a
+    # timestamp. Whole months, days and hours that can't match are skipped
+    # in one step.
+    def next_after(self, timestamp):
+        moment = datetime.fromtimestamp(timestamp).replace(second=0,
+                                                           microsecond=0)
+        moment += timedelta(minutes=1)
+        limit = moment + search_limit
+
+        while moment < limit:
+            if moment.month not in self.months:
+                moment = (moment.replace(day=1, hour=0, minute=0) +
+                          timedelta(days=32)).replace(day=1)
+
+            elif not self.matches_day(moment):
+                moment = moment.replace(hour=0, minute=0) + \
+                    timedelta(days=1)
+
+            elif moment.hour not in self.hours:
+                moment = moment.replace(minute=0) + timedelta(hours=1)
+
+            elif moment.minute not in self.minutes:
+                moment += timedelta(minutes=1)
+
+            else:
+                return moment.timestamp()
+
+        raise CronError('%s never runs' % self.text)
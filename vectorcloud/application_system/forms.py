@@ -3,8 +3,8 @@
 from flask_wtf import FlaskForm
 from flask_wtf.file import FileField, FileAllowed
 from wtforms import StringField, SubmitField, TextAreaField,\
-    MultipleFileField, BooleanField
-from wtforms.validators import DataRequired
+    MultipleFileField, BooleanField, IntegerField, SelectField
+from wtforms.validators import DataRequired, Optional, NumberRange
 
 
 class UploadScript(FlaskForm):
@@ -39,3 +39,20 @@ class AppSettings(FlaskForm):
     value = StringField('Value')
 
     save = SubmitField('Save')
+
+
+class ScheduleForm(FlaskForm):
+    cron = StringField('Cron Expression (e.g. 0 3 * * *)')
+
+    interval = IntegerField('Or Run Every (minutes)',
+                            validators=[Optional(), NumberRange(min=1)])
+
+    misfire = SelectField('If a Run Was Missed',
+                          choices=[('run_once', 'Run once when possible'),
+                                   ('skip', 'Skip it')])
+
+    overlap = SelectField('If the Last Run Is Still Going',
+                          choices=[('skip', 'Skip this run'),
+                                   ('wait', 'Run when it finishes')])
+
+    add_schedule = SubmitField('Add Schedule')
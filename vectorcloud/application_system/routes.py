@@ -1,20 +1,26 @@
 #!/usr/bin/env python3
 
 import os
-import subprocess
-import platform
-import multiprocessing
-import signal
+import json
+import time
+from collections import deque
 from sqlalchemy import func
-from flask import render_template, url_for, redirect, flash, request, Blueprint
-from vectorcloud.application_system.forms import UploadScript, AppSettings
-from vectorcloud.models import Application, AppSupport, Status, Output,\
-    ApplicationStore
+from flask import render_template, url_for, redirect, flash, request,\
+    Blueprint, jsonify, abort, send_file, Response
+from vectorcloud.application_system.forms import UploadScript, AppSettings,\
+    ScheduleForm
+from vectorcloud.models import Application, AppSupport,\
+    ApplicationStore, AppSchedule, AppRun
 from vectorcloud import app, db
-from vectorcloud.main.utils import get_stats
+from vectorcloud.main.utils import get_stats, current_status,\
+    selected_serial
 from vectorcloud.main.routes import sdk_version
 from vectorcloud.application_system.utils import save_icon, save_script,\
     save_script_helpers, get_script_folder, get_lib_folder
+from vectorcloud.application_system.runner import process_supervisor
+from vectorcloud.application_system.schedules import schedule_runner,\
+    next_run_after
+from vectorcloud.application_system.cron import CronError
 
 
 application_system = Blueprint('application_system', __name__)
@@ -60,7 +66,7 @@ def upload():
     if err_msg:
         return redirect(url_for('error_pages.' + err_msg))
 
-    vector_status = Status.query.first()
+    vector_status = current_status()
     form = UploadScript()
     applications = Application.query.all()
 
@@ -118,28 +124,6 @@ def upload():
         sdk_version=sdk_version)
 
 
-def start_bkrd_script(py_cmd, script_path, application):
-    pid = os.getpid()
-    application.pid = pid
-    db.session.commit()
-
-    out = subprocess.run(py_cmd + script_path, stdout=subprocess.PIPE,
-                         shell=True, encoding='utf-8')
-
-    if out.returncode == 0:
-        msg = application.script_name + ' ran succussfully! Output: ' +\
-            str(out.stdout)
-        output = Output(output=msg)
-        db.session.add(output)
-
-    else:
-        msg = 'Something is not right, try again.'
-        output = Output(output=msg)
-        db.session.add(output)
-
-    application.pid = None
-    db.session.commit()
-
 # runs a script from the database by hex id. Hex id is passed into the url
 # e.g. /run_script/cb893c1cee6d7e87 would run the script with hex id
 # cb893c1cee6d7e87 in the database
@@ -150,52 +134,143 @@ def run_script(script_hex_id):
     application = Application.query.filter_by(hex_id=script_hex_id).first()
     scriptn = script_hex_id + '.py'
     script_path = os.path.join(scripts_folder, scriptn)
+    serial = selected_serial()
+    if serial is None:
+        flash('No Vector is set up in sdk_config.ini.', 'warning')
+        return redirect(url_for('main.home'))
 
-    if platform.system() == 'Windows':
-        py_cmd = 'py '
-
-    else:
-        py_cmd = 'python3 '
-
+    # foreground applications go ahead of the background ones and start on a
+    # warm interpreter from the pool; the request doesn't wait for them, the
+    # output is followed live on /app_log/<hex_id> instead
     if application.run_in_bkrd is False:
-        out = subprocess.run(py_cmd + script_path, stdout=subprocess.PIPE,
-                             shell=True, encoding='utf-8')
-
-        if out.returncode == 0:
-            flash(application.script_name + ' ran succussfully! Output: ' +
-                  str(out.stdout), 'success')
+        if process_supervisor.run_in_foreground(application, script_path,
+                                                serial) is None:
+            flash(application.script_name + ' is already running.',
+                  'warning')
+            return redirect(url_for('main.home'))
 
-        else:
-            flash('Something is not right. Try again', 'warning')
-        return redirect(url_for('main.home'))
+        return redirect(url_for('application_system.app_log',
+                                script_hex_id=application.hex_id))
 
+    # background applications are queued until the robot is free, then
+    # started and watched by the supervisor, which saves their output when
+    # they exit
     else:
         get_stats(force=True)
-        t = multiprocessing.Process(target=start_bkrd_script,
-                                    args=(py_cmd, script_path, application))
-        t.start()
-        flash('Process Started!', 'success')
-        return redirect(url_for('main.home'))
 
+        if process_supervisor.start(application, script_path,
+                                    serial) is None:
+            flash(application.script_name + ' is already running.',
+                  'warning')
 
-@application_system.route("/kill_process/<pid>")
-def kill_process(pid):
-    application = Application.query.filter_by(pid=pid).first()
+        else:
+            flash('Process Started!', 'success')
+        return redirect(url_for('main.home'))
 
-    if application:
-        application.pid = None
-        db.session.commit()
 
-    try:
-        os.kill(int(pid), signal.SIGINT)
+# stops a background application. Only the supervisor's own children can be
+# stopped, its pid is cleared once it has exited.
+@application_system.route("/kill_process/<int:pid>")
+def kill_process(pid):
+    if process_supervisor.stop(pid):
         flash('Process Killed!', 'success')
 
-    except ProcessLookupError:
+    else:
         flash('Process has already ended or is not found.', 'warning')
 
     return redirect(url_for('main.home'))
 
 
+# the background applications currently running, as json
+@application_system.route("/background_processes")
+def background_processes():
+    return jsonify(processes=process_supervisor.snapshot())
+
+
+# seconds between keepalive comments on an idle log stream
+_keepalive_interval = 15
+
+
+# server-sent events generator: sends the application's new output lines (as
+# a json list) as they are written, then an "end" event once the run is over
+def log_events(log):
+    position = 0
+
+    while True:
+        position, lines, closed = log.lines_since(position,
+                                                  _keepalive_interval)
+        if lines:
+            yield 'data: ' + json.dumps(lines) + '\n\n'
+
+        elif closed:
+            yield 'event: end\ndata: \n\n'
+            return
+
+        # lets the server notice a closed page
+        else:
+            yield ': keepalive\n\n'
+
+
+# output of an application's last run. A run that is still going is followed
+# live over /app_log/<hex_id>/events, a finished one shows the end of its log
+# file.
+@application_system.route("/app_log/<script_hex_id>")
+def app_log(script_hex_id):
+    err_msg = get_stats()
+    if err_msg:
+        return redirect(url_for('error_pages.' + err_msg))
+
+    vector_status = current_status()
+    application = Application.query.filter_by(hex_id=script_hex_id).first()
+    if application is None:
+        abort(404)
+
+    log = process_supervisor.log(script_hex_id)
+    live = log is not None and not log.closed
+    log_text = None
+    log_file = process_supervisor.log_file(script_hex_id)
+
+    if not live and os.path.isfile(log_file):
+        with open(log_file, encoding='utf-8', errors='replace') as f:
+            log_text = ''.join(deque(f, maxlen=process_supervisor.log_tail))
+
+    return render_template(
+        'applications/app_log.html',
+        title='Application Output',
+        vector_status=vector_status,
+        sdk_version=sdk_version,
+        application=application,
+        live=live,
+        log_text=log_text,
+        has_log_file=os.path.isfile(log_file))
+
+
+@application_system.route("/app_log/<script_hex_id>/events")
+def app_log_events(script_hex_id):
+    log = process_supervisor.log(script_hex_id)
+    if log is None:
+        abort(404)
+
+    response = Response(log_events(log), mimetype='text/event-stream')
+    response.headers['Cache-Control'] = 'no-cache'
+    response.headers['X-Accel-Buffering'] = 'no'
+    return response
+
+
+# the whole log file of an application's last run, as plain text
+@application_system.route("/app_log/<script_hex_id>/download")
+def app_log_download(script_hex_id):
+    application = Application.query.filter_by(hex_id=script_hex_id).first()
+    if application is None:
+        abort(404)
+
+    log_file = process_supervisor.log_file(application.hex_id)
+    if not os.path.isfile(log_file):
+        abort(404)
+
+    return send_file(log_file, mimetype='text/plain')
+
+
 # edit application page
 @application_system.route("/edit_application/<script_id>",
                           methods=['GET', 'POST'])
@@ -204,7 +279,7 @@ def edit_application(script_id):
     if err_msg:
         return redirect(url_for('error_pages.' + err_msg))
 
-    vector_status = Status.query.first()
+    vector_status = current_status()
     form = UploadScript()
     application = Application.query.filter_by(id=script_id).first()
     support_files = AppSupport.query.filter_by(hex_id=application.hex_id)
@@ -260,9 +335,14 @@ def edit_application(script_id):
     helper_list = []
     for file in support_files:
         helper_list.append(file.file_name)
+
+    schedules = AppSchedule.query.filter_by(hex_id=application.hex_id).all()
+    runs = AppRun.query.filter_by(hex_id=application.hex_id).\
+        order_by(AppRun.id.desc()).limit(10).all()
     return render_template('applications/edit_application.html',
                            title='Edit Application',
                            form=form,
+                           schedule_form=ScheduleForm(),
                            script_id=script_id,
                            support_files=support_files,
                            support_files_first=support_files_first,
@@ -270,7 +350,89 @@ def edit_application(script_id):
                            vector_status=vector_status,
                            sdk_version=sdk_version,
                            settings_file=settings_file,
-                           helper_list=helper_list)
+                           helper_list=helper_list,
+                           schedules=schedules,
+                           runs=runs)
+
+
+# formats a unix timestamp for the schedule and run tables
+@application_system.app_template_filter('timestamp')
+def format_timestamp(timestamp):
+    if timestamp is None:
+        return '-'
+    return time.strftime('%Y-%m-%d %H:%M', time.localtime(timestamp))
+
+
+# adds a schedule (from the form on the edit application page) that runs the
+# application in the background on the selected robot
+@application_system.route("/add_schedule/<int:script_id>", methods=['POST'])
+def add_schedule(script_id):
+    application = Application.query.filter_by(id=script_id).first()
+    if application is None:
+        abort(404)
+
+    form = ScheduleForm()
+    cron = (form.cron.data or '').strip()
+
+    if not form.validate_on_submit():
+        flash('Check the schedule and try again.', 'warning')
+
+    elif bool(cron) == bool(form.interval.data):
+        flash('Give either a cron expression or an interval.', 'warning')
+
+    else:
+        schedule = AppSchedule(hex_id=application.hex_id,
+                               cron=cron or None,
+                               interval=form.interval.data * 60
+                               if form.interval.data else None,
+                               serial=selected_serial(),
+                               misfire=form.misfire.data,
+                               overlap=form.overlap.data)
+        try:
+            schedule.next_run = next_run_after(schedule, time.time())
+            db.session.add(schedule)
+            db.session.commit()
+            schedule_runner.reload()
+            flash('Schedule added!', 'success')
+
+        except CronError as e:
+            flash(str(e), 'warning')
+
+    return redirect(url_for('application_system.edit_application',
+                            script_id=script_id))
+
+
+# pauses or resumes a schedule. A resumed schedule starts over from now
+# rather than catching up on the runs it skipped while paused.
+@application_system.route("/toggle_schedule/<int:schedule_id>")
+def toggle_schedule(schedule_id):
+    schedule = AppSchedule.query.filter_by(id=schedule_id).first()
+    if schedule is None:
+        abort(404)
+
+    schedule.enabled = not schedule.enabled
+    schedule.next_run = None
+    db.session.commit()
+    schedule_runner.reload()
+
+    application = Application.query.filter_by(hex_id=schedule.hex_id).first()
+    return redirect(url_for('application_system.edit_application',
+                            script_id=application.id))
+
+
+@application_system.route("/delete_schedule/<int:schedule_id>")
+def delete_schedule(schedule_id):
+    schedule = AppSchedule.query.filter_by(id=schedule_id).first()
+    if schedule is None:
+        abort(404)
+
+    application = Application.query.filter_by(hex_id=schedule.hex_id).first()
+    db.session.delete(schedule)
+    db.session.commit()
+    schedule_runner.reload()
+    flash('Schedule Deleted!', 'success')
+    return redirect(url_for('application_system.edit_application',
+                            script_id=application.id))
 
 
 # this deletes an application by it's unique key (id column). This will delete:
@@ -308,8 +470,11 @@ def delete_application(script_id):
     if application.icon != 'default.png':
         os.remove(icon_path)
 
+    AppSchedule.query.filter_by(hex_id=hex_id).delete()
+    AppRun.query.filter_by(hex_id=hex_id).delete()
     Application.query.filter_by(id=script_id).delete()
     db.session.commit()
+    schedule_runner.reload()
     flash('Application Deleted!', 'success')
     return redirect(url_for('main.home'))
 
@@ -340,7 +505,7 @@ def edit_app_settings_file(hex_id):
     err_msg = get_stats()
     if err_msg:
         return redirect(url_for('error_pages.' + err_msg))
-    vector_status = Status.query.first()
+    vector_status = current_status()
     application = Application.query.filter_by(hex_id=hex_id).first()
     settings_file_fn = os.path.join(lib_folder, hex_id + '.ini')
     f = open(settings_file_fn)
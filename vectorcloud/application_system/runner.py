@@ -0,0 +1,549 @@
+#!/usr/bin/env python3
+
+import os
+import sys
+import json
+import time
+import atexit
+import signal
+import platform
+import threading
+import subprocess
+from collections import deque
+from vectorcloud import app, db
+from vectorcloud.models import Application, Output, AppRun
+from vectorcloud.robot_system.connection import connection_manager
+from vectorcloud.robot_system.scheduler import robot_scheduler, RobotBusy
+
+
+worker_file = os.path.join(os.path.dirname(os.path.realpath(__file__)),
+                           'worker.py')
+
+
+# ------------------------------------------------------------------------------
+# Interpreter pool
+# ------------------------------------------------------------------------------
+
+# keeps size warm worker interpreters (worker.py) waiting with the SDK already
+# imported, so running an application skips the interpreter start and the
+# anki_vector/grpc/protobuf imports. Workers are spawned rather than forked
+# from the web app, which runs threads that a fork would copy mid-flight.
+# Every worker runs a single application and exits, and a replacement is
+# started as soon as one is taken, so runs are as isolated as separate
+# "python3 <hex_id>.py" processes.
+class InterpreterPool:
+
+    def __init__(self, size=2):
+        self.size = size
+        self.idle = deque()
+        self.lock = threading.Lock()
+
+    # stderr goes into the same pipe as stdout, and -u keeps the worker's
+    # output unbuffered so it can be followed as it is written
+    def spawn(self):
+        return subprocess.Popen([sys.executable, '-u', worker_file],
+                                stdin=subprocess.PIPE,
+                                stdout=subprocess.PIPE,
+                                stderr=subprocess.STDOUT,
+                                encoding='utf-8', errors='replace')
+
+    # the caller holds the lock
+    def fill(self):
+        while len(self.idle) < self.size:
+            self.idle.append(self.spawn())
+
+    # a warm worker if there is one, otherwise a new (cold) one. Workers
+    # are first started here rather than at import so the reloader's watcher
+    # process never starts any.
+    def acquire(self):
+        with self.lock:
+            worker = None
+            while self.idle and worker is None:
+                worker = self.idle.popleft()
+                if worker.poll() is not None:
+                    worker = None
+
+            if worker is None:
+                worker = self.spawn()
+
+            self.fill()
+            return worker
+
+    # warm(): gets the pool filled ahead of the first run, e.g. when the
+    # applications are listed
+    def warm(self):
+        with self.lock:
+            self.fill()
+
+    # start(): starts an application on a worker, with env added to its
+    # environment, and returns the worker, a Popen whose stdout is the
+    # application's output (stderr included)
+    def start(self, script_path, args=(), env=None):
+        worker = self.acquire()
+        worker.stdin.write(json.dumps({'script': script_path,
+                                       'args': list(args),
+                                       'env': env or {}}) + '\n')
+        worker.stdin.close()
+        return worker
+
+    # closing an idle worker's stdin makes it exit without running anything
+    def shutdown(self):
+        with self.lock:
+            while self.idle:
+                worker = self.idle.popleft()
+                worker.stdin.close()
+                worker.stdout.close()
+
+
+# ------------------------------------------------------------------------------
+# Application logs
+# ------------------------------------------------------------------------------
+
+# the output of one application run. Every line is written to the log file as
+# soon as the application prints it, so the whole run can be viewed later,
+# while only the last tail_lines lines are kept in memory for the pages
+# following the run live. count is the number of lines written so far, which
+# followers use as their position in the log.
+class AppLog:
+
+    def __init__(self, path, tail_lines=500):
+        self.path = path
+        self.tail = deque(maxlen=tail_lines)
+        self.count = 0
+        self.closed = False
+        self.condition = threading.Condition()
+        self.file = open(path, 'w', encoding='utf-8')
+
+    # follow(): copies stream into the log until it ends
+    def follow(self, stream):
+        try:
+            for line in stream:
+                self.write(line)
+
+        finally:
+            stream.close()
+            self.close()
+
+    def write(self, line):
+        self.file.write(line)
+        self.file.flush()
+
+        with self.condition:
+            self.tail.append(line)
+            self.count += 1
+            self.condition.notify_all()
+
+    def close(self):
+        self.file.close()
+
+        with self.condition:
+            self.closed = True
+            self.condition.notify_all()
+
+    # lines_since(): waits until there are lines after position, the log is
+    # closed or timeout seconds pass. Returns (new position, lines, closed);
+    # lines that have already left the tail are skipped.
+    def lines_since(self, position=0, timeout=None):
+        with self.condition:
+            self.condition.wait_for(
+                lambda: self.count > position or self.closed, timeout)
+
+            new_lines = min(self.count - position, len(self.tail))
+            lines = list(self.tail)[len(self.tail) - new_lines:]
+            return self.count, lines, self.closed
+
+    def text(self):
+        with self.condition:
+            return ''.join(self.tail)
+
+
+# ------------------------------------------------------------------------------
+# Background applications
+# ------------------------------------------------------------------------------
+
+# the robot scheduler owner of an application's runs
+def run_owner(application):
+    return '%s (%s)' % (application.script_name, application.hex_id[:8])
+
+
+# record_run(): adds the AppRun row of one run to the session, the caller
+# commits
+def record_run(hex_id, outcome, started=None, duration=None, returncode=None,
+               schedule_id=None):
+    db.session.add(AppRun(hex_id=hex_id, schedule_id=schedule_id,
+                          started=started, duration=duration,
+                          outcome=outcome, returncode=returncode))
+
+
+# the outcome of a run that exited
+def exit_outcome(returncode, stopped=False):
+    if stopped:
+        return 'stopped'
+    return 'success' if returncode == 0 else 'failed'
+
+
+# one application run by the supervisor. It is queued until the robot is free
+# for it, then launch() starts it and its output is read into its log as it
+# is written, so an application printing a lot never blocks on a full pipe.
+# schedule_id is the AppSchedule that started it, if any. A run with a
+# deadline gives up (and is recorded as busy) if the robot isn't free by then.
+class BackgroundProcess:
+
+    def __init__(self, application, serial, log, schedule_id=None,
+                 priority='low', deadline=None):
+        self.hex_id = application.hex_id
+        self.schedule_id = schedule_id
+        self.priority = priority
+        self.deadline = deadline
+        self.script_name = application.script_name
+        self.owner = run_owner(application)
+        self.serial = serial
+        self.log = log
+        self.process = None
+        self.pid = None
+        self.reader = None
+        self.queued = time.time()
+        self.started = None
+        self.finished = None
+        self.heartbeat = self.queued
+        self.stop_requested = None
+        self.cancelled = False
+        self.busy = False
+
+    def launch(self, process):
+        self.process = process
+        self.pid = process.pid
+        self.started = time.time()
+        self.reader = threading.Thread(target=self.log.follow,
+                                       args=(process.stdout,),
+                                       name='app-output-reader',
+                                       daemon=True)
+        self.reader.start()
+
+    def state(self):
+        if self.process is None:
+            return 'queued'
+        if self.stop_requested is not None:
+            return 'stopping'
+        return 'running'
+
+    def to_dict(self):
+        return {'pid': self.pid,
+                'hex_id': self.hex_id,
+                'script_name': self.script_name,
+                'serial': self.serial,
+                'schedule_id': self.schedule_id,
+                'state': self.state(),
+                'queued': self.queued,
+                'started': self.started,
+                'heartbeat': self.heartbeat}
+
+
+# starts applications as direct children of the web app and keeps track of
+# the background ones in memory. Every run first claims its robot from the
+# robot scheduler, so applications take turns with each other and with the
+# web app's own robot jobs instead of fighting over behavior control;
+# background runs wait in line at low priority until the robot is free, and
+# foreground runs at normal priority for up to claim_timeout seconds. Each
+# application runs once at a time, a second run is refused while one is
+# queued or running. Every run is recorded as an AppRun.
+#
+# A monitor thread checks on every child each heartbeat_interval seconds:
+# poll() reaps the ones that exited (so none are left as zombies), their
+# output is saved for the home page, their claim on the robot is released
+# and their Application.pid is cleared. The pid column is only a copy of this
+# state for the templates; stop() acts on the supervisor's own children,
+# never on whatever process a stale pid might point at now.
+class ProcessSupervisor:
+
+    def __init__(self, heartbeat_interval=1, stop_timeout=5,
+                 log_folder=None, log_tail=500, claim_timeout=30):
+        self.heartbeat_interval = heartbeat_interval
+        self.stop_timeout = stop_timeout
+        self.log_folder = log_folder
+        self.log_tail = log_tail
+        self.claim_timeout = claim_timeout
+        self.processes = {}
+        self.logs = {}
+        self.lock = threading.Lock()
+        self.monitor = None
+
+    # the log of the last run of an application, kept between runs
+    def log_file(self, hex_id):
+        return os.path.join(self.log_folder, hex_id + '.log')
+
+    # the last run's log if it ran since the web app started, else None
+    def log(self, hex_id):
+        with self.lock:
+            return self.logs.get(hex_id)
+
+    # the caller holds the lock
+    def is_running(self, hex_id):
+        if hex_id in self.processes:
+            return True
+
+        log = self.logs.get(hex_id)
+        return log is not None and not log.closed
+
+    # the caller holds the lock
+    def open_log(self, hex_id):
+        os.makedirs(self.log_folder, exist_ok=True)
+        log = AppLog(self.log_file(hex_id), self.log_tail)
+        self.logs[hex_id] = log
+        return log
+
+    # the application's SDK connection goes to serial (apps find their robot
+    # through anki_vector.util.parse_command_args()), and the web app gives
+    # its own behavior control back first so the application can take it
+    def spawn(self, script_path, serial):
+        connection_manager.release_control(serial)
+        env = {'ANKI_ROBOT_SERIAL': serial} if serial else {}
+        return interpreter_pool.start(script_path, env=env)
+
+    # run_in_foreground(): queues application to run on serial ahead of the
+    # background runs, without waiting for it. Its output can be followed on
+    # /app_log/<hex_id>. Returns None if it is already queued or running; a
+    # run that can't get the robot within claim_timeout is recorded as busy.
+    def run_in_foreground(self, application, script_path, serial):
+        return self.start(application, script_path, serial,
+                          priority='normal',
+                          deadline=time.time() + self.claim_timeout)
+
+    # start(): queues application to run in the background on serial as soon
+    # as the robot is free. Returns None if it is already queued or running.
+    def start(self, application, script_path, serial, schedule_id=None,
+              priority='low', deadline=None):
+        with self.lock:
+            if self.is_running(application.hex_id):
+                return None
+
+            background = BackgroundProcess(application, serial,
+                                           self.open_log(application.hex_id),
+                                           schedule_id, priority, deadline)
+            self.processes[background.hex_id] = background
+
+            # started on first use, and ends once nothing is left running
+            if self.monitor is None:
+                self.monitor = threading.Thread(target=self.run,
+                                                name='app-supervisor',
+                                                daemon=True)
+                self.monitor.start()
+
+        threading.Thread(target=self.launch, args=(background, script_path),
+                         name='app-launcher', daemon=True).start()
+        return background
+
+    # launch(): waits for the robot, then starts a queued application. A run
+    # that is stopped while it waits is cancelled without being started.
+    def launch(self, background, script_path):
+        while True:
+            if background.stop_requested is not None:
+                self.cancel(background)
+                return
+
+            try:
+                robot_scheduler.acquire(background.serial, background.owner,
+                                        background.priority,
+                                        self.heartbeat_interval)
+                break
+
+            except RobotBusy as e:
+                if background.deadline is not None and \
+                        time.time() > background.deadline:
+                    background.log.write('Not run: %s\n' % e)
+                    background.busy = True
+                    self.cancel(background)
+                    return
+
+        # spawning gives the web app's behavior control back first, a robot
+        # call, so it runs without the lock
+        process = None
+        try:
+            if background.stop_requested is None:
+                process = self.spawn(script_path, background.serial)
+
+        except Exception:
+            app.logger.exception('Could not start %s',
+                                 background.script_name)
+
+        if process is not None:
+            with self.lock:
+                background.launch(process)
+
+                # stopped while it was being spawned
+                if background.stop_requested is not None:
+                    self.send_stop(background)
+
+        if background.process is None:
+            robot_scheduler.release(background.serial, background.owner)
+            self.cancel(background)
+            return
+
+        with app.app_context():
+            try:
+                Application.query.filter_by(hex_id=background.hex_id).\
+                    update({'pid': background.pid})
+                db.session.commit()
+
+            finally:
+                db.session.remove()
+
+    def cancel(self, background):
+        background.log.close()
+        background.cancelled = True
+
+    # stop(): asks a supervised application to stop (SIGINT, like Ctrl-C).
+    # One still running stop_timeout seconds later is killed. Returns False
+    # if pid isn't one of ours.
+    def stop(self, pid):
+        with self.lock:
+            for background in self.processes.values():
+                if background.pid == pid:
+                    self.request_stop(background)
+                    return True
+
+            return False
+
+    # the caller holds the lock. A queued run is cancelled by its launcher.
+    def request_stop(self, background):
+        if background.stop_requested is not None:
+            return
+
+        background.stop_requested = time.time()
+        if background.process is not None:
+            self.send_stop(background)
+
+    # the caller holds the lock
+    def send_stop(self, background):
+        try:
+            if platform.system() == 'Windows':
+                background.process.terminate()
+            else:
+                background.process.send_signal(signal.SIGINT)
+
+        except ProcessLookupError:
+            pass
+
+    def stop_all(self):
+        with self.lock:
+            for background in self.processes.values():
+                self.request_stop(background)
+
+    # live state of every supervised application
+    def snapshot(self):
+        with self.lock:
+            return [background.to_dict()
+                    for background in self.processes.values()]
+
+    # reconcile(): clears pids left in the database by a previous run of the
+    # web app. Those processes aren't our children, and the pid may well
+    # belong to something else by now.
+    def reconcile(self):
+        with self.lock:
+            live_pids = set(background.pid
+                            for background in self.processes.values())
+
+        stale = Application.query.filter(Application.pid.isnot(None)).all()
+        for application in stale:
+            if application.pid not in live_pids:
+                app.logger.info('Clearing stale pid %d of %s',
+                                application.pid, application.script_name)
+                application.pid = None
+
+        db.session.commit()
+
+    def run(self):
+        while True:
+            time.sleep(self.heartbeat_interval)
+            now = time.time()
+            finished = []
+
+            with self.lock:
+                for hex_id, background in list(self.processes.items()):
+                    if background.cancelled:
+                        finished.append(self.processes.pop(hex_id))
+                        continue
+
+                    background.heartbeat = now
+                    if background.process is None:
+                        continue
+
+                    if background.process.poll() is not None:
+                        background.finished = now
+                        finished.append(self.processes.pop(hex_id))
+                        continue
+
+                    if background.stop_requested is not None and \
+                            now - background.stop_requested > \
+                            self.stop_timeout:
+                        background.process.kill()
+
+                done = not self.processes
+                if done:
+                    self.monitor = None
+
+            # a cancelled run gave its claim back when it was cancelled
+            for background in finished:
+                if background.process is not None:
+                    robot_scheduler.release(background.serial,
+                                            background.owner)
+
+            if finished:
+                with app.app_context():
+                    try:
+                        self.finish(finished)
+
+                    except Exception:
+                        app.logger.exception('Could not record finished '
+                                             'background applications')
+
+                    finally:
+                        db.session.remove()
+
+            if done:
+                return
+
+    # finish(): records the finished runs, saves the output of the
+    # applications that exited on their own and clears their pids
+    def finish(self, finished):
+        for background in finished:
+            if background.process is None:
+                record_run(background.hex_id,
+                           'busy' if background.busy else 'cancelled',
+                           background.queued,
+                           schedule_id=background.schedule_id)
+                continue
+
+            background.reader.join(timeout=1)
+            returncode = background.process.returncode
+            record_run(background.hex_id,
+                       exit_outcome(returncode,
+                                    background.stop_requested is not None),
+                       background.started,
+                       background.finished - background.started,
+                       returncode, background.schedule_id)
+
+            if background.stop_requested is None:
+                if background.process.returncode == 0:
+                    msg = background.script_name + ' ran succussfully! ' +\
+                        'Output: ' + background.log.text()
+                else:
+                    msg = 'Something is not right, try again.'
+                db.session.add(Output(output=msg))
+
+            Application.query.filter_by(pid=background.pid).\
+                update({'pid': None})
+
+        db.session.commit()
+
+
+interpreter_pool = InterpreterPool(size=app.config['APP_POOL_SIZE'])
+process_supervisor = ProcessSupervisor(
+    heartbeat_interval=app.config['APP_HEARTBEAT_INTERVAL'],
+    stop_timeout=app.config['APP_STOP_TIMEOUT'],
+    log_folder=app.config['APP_LOG_FOLDER'],
+    log_tail=app.config['APP_LOG_TAIL'],
+    claim_timeout=app.config['ROBOT_CLAIM_TIMEOUT'])
+
+atexit.register(interpreter_pool.shutdown)
+atexit.register(process_supervisor.stop_all)
@@ -0,0 +1,184 @@
+#!/usr/bin/env python3
+
+import os
+import time
+import heapq
+import itertools
+import threading
+from vectorcloud import app, db
+from vectorcloud.models import Application, AppSchedule
+from vectorcloud.application_system.cron import CronExpression
+from vectorcloud.application_system.runner import process_supervisor,\
+    record_run
+from vectorcloud.application_system.utils import scripts_folder
+from vectorcloud.robot_system.connection import default_serial
+
+
+# what to do when a run was missed by more than the misfire grace (the web
+# app was down, or busy): run once now for all of the missed runs, or skip
+# them and wait for the next one
+misfire_policies = ('run_once', 'skip')
+
+# what to do when a run is due while the last one is still queued or
+# running: skip this run, or wait for the last one to finish and run then
+overlap_policies = ('skip', 'wait')
+
+
+# next_run_after(): when schedule runs next after timestamp. Intervals count
+# from the run that was due, skipping the ones already missed.
+def next_run_after(schedule, timestamp, due=None):
+    if schedule.cron:
+        return CronExpression(schedule.cron).next_after(timestamp)
+
+    next_run = (due or timestamp) + schedule.interval
+    if next_run <= timestamp:
+        missed = (timestamp - next_run) // schedule.interval + 1
+        next_run += missed * schedule.interval
+    return next_run
+
+
+# ------------------------------------------------------------------------------
+# Schedule runner
+# ------------------------------------------------------------------------------
+
+# runs the enabled AppSchedules from one thread. Every schedule has a single
+# (due time, sequence, schedule id) entry in a heap, and the thread sleeps
+# until the earliest entry is due, so any number of schedules costs one
+# thread. Due runs are handed to the process supervisor as background runs,
+# which queue until the robot is free. AppSchedule.next_run is saved after
+# every run, so runs missed while the web app was down are found (and dealt
+# with by the schedule's misfire policy) when it starts again. reload() has
+# to be called after schedules are changed; the heap is rebuilt on the
+# runner's own thread, which has its own database session.
+class ScheduleRunner:
+
+    def __init__(self, misfire_grace=60, retry_interval=10):
+        self.misfire_grace = misfire_grace
+        self.retry_interval = retry_interval
+        self.heap = []
+        self.sequence = itertools.count()
+        self.stale = True
+        self.condition = threading.Condition()
+        self.thread = None
+
+    # the thread is started on the first request rather than at import so
+    # the reloader's watcher process never runs anything
+    def start(self):
+        with self.condition:
+            if self.thread is not None:
+                return
+
+            self.thread = threading.Thread(target=self.run,
+                                           name='app-schedules',
+                                           daemon=True)
+            self.thread.start()
+
+    def reload(self):
+        with self.condition:
+            self.stale = True
+            self.condition.notify_all()
+
+    # load(): rebuilds the heap from the database. A new schedule runs first
+    # one interval (or at the next cron match) from now.
+    def load(self):
+        now = time.time()
+        entries = []
+
+        for schedule in AppSchedule.query.filter_by(enabled=True):
+            if schedule.next_run is None:
+                schedule.next_run = next_run_after(schedule, now)
+            entries.append((schedule.next_run, next(self.sequence),
+                            schedule.id))
+        db.session.commit()
+
+        heapq.heapify(entries)
+        with self.condition:
+            self.heap = entries
+
+    def push(self, due, schedule_id):
+        with self.condition:
+            heapq.heappush(self.heap,
+                           (due, next(self.sequence), schedule_id))
+            self.condition.notify_all()
+
+    # the caller holds the condition
+    def is_idle(self):
+        if self.stale:
+            return False
+        return not self.heap or self.heap[0][0] > time.time()
+
+    def run(self):
+        while True:
+            with self.condition:
+                while self.is_idle():
+                    timeout = self.heap[0][0] - time.time() \
+                        if self.heap else None
+                    self.condition.wait(timeout)
+
+                if self.stale:
+                    self.stale = False
+                    due = schedule_id = None
+                else:
+                    due, _, schedule_id = heapq.heappop(self.heap)
+
+            with app.app_context():
+                try:
+                    if schedule_id is None:
+                        self.load()
+                    else:
+                        self.fire(schedule_id, due)
+
+                except Exception:
+                    app.logger.exception('Schedule runner failed')
+
+                finally:
+                    db.session.remove()
+
+    # fire(): runs a schedule that is due, honoring its misfire and overlap
+    # policies, and queues its next run
+    def fire(self, schedule_id, due):
+        schedule = AppSchedule.query.get(schedule_id)
+        if schedule is None or not schedule.enabled:
+            return
+
+        # a reload() since this entry was queued has replaced it
+        if schedule.next_run is not None and schedule.next_run > due:
+            return
+
+        application = Application.query.filter_by(
+            hex_id=schedule.hex_id).first()
+        if application is None:
+            return
+
+        now = time.time()
+        if now - due > self.misfire_grace and schedule.misfire == 'skip':
+            record_run(schedule.hex_id, 'missed', due,
+                       schedule_id=schedule.id)
+
+        else:
+            script_path = os.path.join(scripts_folder,
+                                       application.hex_id + '.py')
+            serial = schedule.serial or default_serial()
+            started = process_supervisor.start(application, script_path,
+                                               serial, schedule.id)
+
+            if started is None and schedule.overlap == 'wait':
+                self.push(now + self.retry_interval, schedule.id)
+                return
+
+            if started is None:
+                record_run(schedule.hex_id, 'skipped', now,
+                           schedule_id=schedule.id)
+            else:
+                schedule.last_run = now
+
+        # counted from the run that was due, not from a 'wait' retry
+        schedule.next_run = next_run_after(schedule, now,
+                                           schedule.next_run or due)
+        db.session.commit()
+        self.push(schedule.next_run, schedule.id)
+
+
+schedule_runner = ScheduleRunner(
+    misfire_grace=app.config['APP_SCHEDULE_MISFIRE_GRACE'],
+    retry_interval=app.config['APP_SCHEDULE_RETRY_INTERVAL'])
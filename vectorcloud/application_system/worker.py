@@ -0,0 +1,43 @@
+#!/usr/bin/env python3
+
+# A warm interpreter for running one installed application, started by
+# InterpreterPool (see runner.py) before anyone asks for it. The SDK (and with
+# it grpc and protobuf) is imported while the worker waits, then one job is
+# read from stdin and the application runs as __main__ exactly as
+# "python3 <hex_id>.py" would run it. The worker exits with the application,
+# so nothing carries over from one run to the next.
+#
+# This file is run by path, not as part of the vectorcloud package, so
+# starting a worker doesn't start another copy of the web app.
+
+import os
+import sys
+import json
+import runpy
+
+try:
+    import anki_vector  # noqa: F401
+except ImportError:
+    pass
+
+
+def main():
+    line = sys.stdin.readline()
+
+    # the pool closed our stdin without sending a job, it is shutting down
+    if not line:
+        return
+
+    job = json.loads(line)
+    script_path = job['script']
+
+    os.environ.update(job.get('env', {}))
+    sys.argv = [script_path] + job.get('args', [])
+    sys.path[0] = os.path.dirname(script_path)
+    sys.stdin = open(os.devnull)
+
+    runpy.run_path(script_path, run_name='__main__')
+
+
+if __name__ == '__main__':
+    main()
@@ -1,16 +1,14 @@
 #!/usr/bin/env python3
 
-import os
 from flask import Blueprint, render_template, redirect, url_for, flash
-from configparser import ConfigParser
-from pathlib import Path
-from vectorcloud.models import Status
 from vectorcloud.error_pages.forms import ChangeIP
+from vectorcloud.main.utils import status_poller, current_status,\
+    selected_serial
+from vectorcloud.robot_system.connection import connection_manager
+from vectorcloud.robot_system.sdk_config import sdk_config
 
 error_pages = Blueprint('error_pages', __name__)
 
-config = ConfigParser()
-
 # ------------------------------------------------------------------------------
 # Error Pages
 # ------------------------------------------------------------------------------
@@ -19,24 +17,19 @@ config = ConfigParser()
 @error_pages.route("/vector_not_found", methods=['GET', 'POST'])
 def vector_not_found():
     form = ChangeIP()
-    status = Status.query.first()
+    status = current_status()
 
     if form.validate_on_submit():
-        home = Path.home()
-        sdk_config_file = os.path.join(home, '.anki_vector', 'sdk_config.ini')
-        f = open(sdk_config_file)
-        serial = f.readline()
-        serial = serial.replace(']', '')
-        serial = serial.replace('[', '')
-        serial = serial.replace('\n', '')
-        f.close()
-        config.read(sdk_config_file)
-        config.set(serial, 'ip', form.new_ip.data)
-
-        with open(sdk_config_file, 'w') as configfile:
-            config.write(configfile)
-            configfile.close()
+        profile = sdk_config.get(selected_serial())
+        if profile is None:
+            flash('No robot found in sdk_config.ini, run the SDK configure '
+                  'script first.', 'warning')
+            return redirect(url_for('error_pages.vector_not_found'))
+
+        sdk_config.update(profile.serial, ip=form.new_ip.data)
+        connection_manager.disconnect(profile.serial)
 
+        status_poller.poll_now(clear_error=True, serial=profile.serial)
         flash('IP address updated!', 'success')
         return redirect(url_for('main.home'))
     return render_template('/error_pages/vector_not_found.html',
@@ -20,13 +20,15 @@ This example lets you control Vector by Remote Control, using a webpage served b
 FLASK BLUEPRINT VERSION - by Ross Mountjoy
 """
 
-import io
+import os
 import json
 import sys
 import time
+import threading
 from io import BytesIO
 try:
-    from flask import make_response, Response, send_file, Blueprint
+    from flask import make_response, Response, send_file, Blueprint,\
+        redirect, url_for, abort, flash
 except ImportError:
     sys.exit("Cannot import from flask: Do `pip3 install --user flask` to install")
 
@@ -46,6 +48,18 @@ try:
 except ImportError:
     sys.exit("Cannot import anki_vector: Do `pip3 install -e .` in the vector home folder to install")
 
+from vectorcloud import app
+from vectorcloud.robot_system.connection import connection_manager,\
+    connection_errors
+from vectorcloud.robot_system.camera import FrameBroadcaster,\
+    StreamSession, negotiate_format
+from vectorcloud.robot_system.recorder import CameraRecorder
+from vectorcloud.robot_system.actions import ActionExecutor
+from vectorcloud.robot_system.animations import animation_catalog
+from vectorcloud.robot_system.scheduler import RobotBusy
+from vectorcloud.main.utils import selected_serial, current_status,\
+    robot_serial
+
 
 def shutdown_flask(request):
     func = request.environ.get('werkzeug.server.shutdown')
@@ -101,8 +115,13 @@ def create_default_image(image_width, image_height, do_gradient=False):
 
 
 flask_app = Blueprint('flask_app', __name__)
+# camera recorders, keyed by serial. They outlive the sessions they record so
+# a recording survives reloading /control
+flask_app.camera_recorders = {}
 _default_camera_image = create_default_image(320, 240)
 _is_mouse_look_enabled_by_default = False
+# how long /events stays quiet before sending a keepalive, in seconds
+_keepalive_interval = 15
 
 
 def remap_to_range(x, x_min, x_max, out_min, out_max):
@@ -115,10 +134,43 @@ def remap_to_range(x, x_min, x_max, out_min, out_max):
     return out_min + ratio * (out_max - out_min)
 
 
+# the remote control session of serial, or of the robot selected in the
+# navigation bar when serial is None
+def get_remote_control_vector(serial=None):
+    serial = robot_serial(serial)
+    remote_control_vector = flask_app.remote_control_sessions.get(serial)
+    if remote_control_vector:
+        remote_control_vector.touch()
+    return remote_control_vector
+
+
+# freeplay hands behavior control back to the robot, turning it off takes
+# control again. Done through the connection so it knows who has control.
+def set_freeplay_enabled(remote_control_vector, is_freeplay_enabled):
+    connection = connection_manager.get_connection(remote_control_vector.serial)
+    with connection.lock:
+        if is_freeplay_enabled:
+            connection.release_control()
+        else:
+            connection.request_control()
+
+
 class RemoteControlVector:
 
-    def __init__(self, robot):
+    def __init__(self, robot, serial=None, version=None):
         self.vector = robot
+        self.serial = serial
+        self.version = version
+
+        # open pages (their /events streams) and the last time a page did
+        # anything, see RemoteControlSessions
+        self.viewers = 0
+        self.last_used = time.time()
+
+        # every /vectorImage viewer of this robot shares one encoder per
+        # stream format and level
+        self.camera_streams = {}
+        self.camera_streams_lock = threading.Lock()
 
         self.drive_forwards = 0
         self.drive_back = 0
@@ -134,9 +186,22 @@ class RemoteControlVector:
 
         self.is_mouse_look_enabled = _is_mouse_look_enabled_by_default
         self.mouse_dir = 0
-
-        all_anim_names = self.vector.anim.anim_list
-        all_anim_names.sort()
+        self.desired_head_angle = None
+
+        # the motor targets set by input handlers, and what was last sent to
+        # the robot. Only the control loop talks to the motors.
+        self.wheel_speeds = (0, 0, 0, 0)
+        self.head_vel = 0
+        self.lift_vel = 0
+        self.sent_wheel_speeds = None
+        self.sent_head_vel = None
+        self.sent_lift_vel = None
+        self.stopped = threading.Event()
+        self.control_loop = threading.Thread(target=self.run_control_loop,
+                                             name='remote-control-loop',
+                                             daemon=True)
+
+        all_anim_names = animation_catalog.get(self.vector, version)
         self.anim_names = []
 
         # Hide a few specific test animations that don't behave well
@@ -170,9 +235,83 @@ class RemoteControlVector:
             self.anim_index_for_key[kI] = anim_idx
             kI += 1
 
-        self.action_queue = []
+        # animations and say_text run one after the other, as soon as the
+        # robot has finished the previous one
+        self.actions = ActionExecutor(max_size=app.config['ACTION_QUEUE_SIZE'],
+                                      overflow=app.config['ACTION_QUEUE_OVERFLOW'])
         self.text_to_say = "Hi I'm Vector"
 
+    def get_camera_stream(self, image_format, level=0):
+        with self.camera_streams_lock:
+            camera_stream = self.camera_streams.get((image_format, level))
+            if camera_stream is None:
+                scale, quality = app.config['CAMERA_STREAM_LEVELS'][level]
+                camera_stream = FrameBroadcaster(
+                    lambda: get_annotated_image(self),
+                    fps=app.config['CAMERA_STREAM_FPS'],
+                    idle_timeout=app.config['CAMERA_STREAM_IDLE_TIMEOUT'],
+                    image_format=image_format,
+                    scale=scale,
+                    quality=quality,
+                    subsampling=app.config['CAMERA_STREAM_SUBSAMPLING'])
+                self.camera_streams[(image_format, level)] = camera_stream
+            return camera_stream
+
+    def touch(self):
+        self.last_used = time.time()
+
+    def start(self):
+        self.control_loop.start()
+        self.actions.start()
+
+    def stop(self):
+        self.stopped.set()
+        self.actions.stop()
+        # a page closed mid-drive never sends the key release
+        try:
+            self.vector.motors.set_wheel_motors(0, 0, 0, 0)
+            self.vector.motors.set_head_motor(0)
+            self.vector.motors.set_lift_motor(0)
+        except connection_errors:
+            pass
+        with self.camera_streams_lock:
+            for camera_stream in self.camera_streams.values():
+                camera_stream.stop()
+
+    def run_control_loop(self):
+        """Samples the latest motor targets CONTROL_LOOP_RATE times a second, however fast input arrives"""
+        interval = 1 / app.config['CONTROL_LOOP_RATE']
+        while not self.stopped.wait(interval):
+            try:
+                self.apply_motors()
+            except connection_errors:
+                # the connection manager reconnects on the next lease, keep
+                # sampling so the robot gets the latest targets once it's back
+                self.sent_wheel_speeds = self.sent_head_vel = self.sent_lift_vel = None
+            except Exception:
+                app.logger.exception('Remote control loop failed')
+
+    def apply_motors(self):
+        """Sends each motor target that changed since it was last sent"""
+        wheel_speeds = self.wheel_speeds
+        if wheel_speeds != self.sent_wheel_speeds:
+            self.vector.motors.set_wheel_motors(*wheel_speeds)
+            self.sent_wheel_speeds = wheel_speeds
+
+        head_vel = self.head_vel
+        if self.is_mouse_look_enabled and self.desired_head_angle is not None:
+            head_angle_delta = self.desired_head_angle - util.radians(self.vector.head_angle_rad).degrees
+            # rounded so sensor noise doesn't turn into a command every tick
+            head_vel = round(head_angle_delta * 0.03, 2)
+        if head_vel != self.sent_head_vel:
+            self.vector.motors.set_head_motor(head_vel)
+            self.sent_head_vel = head_vel
+
+        lift_vel = self.lift_vel
+        if lift_vel != self.sent_lift_vel:
+            self.vector.motors.set_lift_motor(lift_vel)
+            self.sent_lift_vel = lift_vel
+
     def set_anim(self, key_index, anim_index):
         self.anim_index_for_key[key_index] = anim_index
 
@@ -186,10 +325,7 @@ class RemoteControlVector:
                 mouse_x, 0.0, 1.0, -mouse_sensitivity, mouse_sensitivity)
             self.update_mouse_driving()
 
-            desired_head_angle = remap_to_range(mouse_y, 0.0, 1.0, 45, -25)
-            head_angle_delta = desired_head_angle - util.radians(self.vector.head_angle_rad).degrees
-            head_vel = head_angle_delta * 0.03
-            self.vector.motors.set_head_motor(head_vel)
+            self.desired_head_angle = remap_to_range(mouse_y, 0.0, 1.0, 45, -25)
 
     def set_mouse_look_enabled(self, is_mouse_look_enabled):
         was_mouse_look_enabled = self.is_mouse_look_enabled
@@ -197,6 +333,7 @@ class RemoteControlVector:
         if not is_mouse_look_enabled:
             # cancel any current mouse-look turning
             self.mouse_dir = 0
+            self.desired_head_angle = None
             if was_mouse_look_enabled:
                 self.update_mouse_driving()
                 self.update_head()
@@ -303,16 +440,7 @@ class RemoteControlVector:
         return out_text
 
     def queue_action(self, new_action):
-        if len(self.action_queue) > 10:
-            self.action_queue.pop(0)
-        self.action_queue.append(new_action)
-
-    def update(self):
-        """Try and execute the next queued action"""
-        if self.action_queue:
-            queued_action, action_args = self.action_queue[0]
-            if queued_action(action_args):
-                self.action_queue.pop(0)
+        self.actions.submit(new_action)
 
     def pick_speed(self, fast_speed, mid_speed, slow_speed):
         if self.go_fast:
@@ -324,14 +452,12 @@ class RemoteControlVector:
 
     def update_lift(self):
         lift_speed = self.pick_speed(8, 4, 2)
-        lift_vel = (self.lift_up - self.lift_down) * lift_speed
-        self.vector.motors.set_lift_motor(lift_vel)
+        self.lift_vel = (self.lift_up - self.lift_down) * lift_speed
 
     def update_head(self):
         if not self.is_mouse_look_enabled:
             head_speed = self.pick_speed(2, 1, 0.5)
-            head_vel = (self.head_up - self.head_down) * head_speed
-            self.vector.motors.set_head_motor(head_vel)
+            self.head_vel = (self.head_up - self.head_down) * head_speed
 
     def update_mouse_driving(self):
         drive_dir = (self.drive_forwards - self.drive_back)
@@ -347,30 +473,148 @@ class RemoteControlVector:
         l_wheel_speed = (drive_dir * forward_speed) + (turn_speed * turn_dir)
         r_wheel_speed = (drive_dir * forward_speed) - (turn_speed * turn_dir)
 
-        self.vector.motors.set_wheel_motors(
-            l_wheel_speed, r_wheel_speed, l_wheel_speed * 4, r_wheel_speed * 4)
-
-
-def get_anim_sel_drop_down(selectorIndex):
-    html_text = """<select onchange="handleDropDownSelect(this)" name="animSelector""" + str(
-        selectorIndex) + """">"""
-    i = 0
-    for anim_name in flask_app.remote_control_vector.anim_names:
-        is_selected_item = (i == flask_app.remote_control_vector.anim_index_for_key[selectorIndex])
-        selected_text = ''' selected="selected"''' if is_selected_item else ""
-        html_text += """<option value=""" + \
-            str(i) + selected_text + """>""" + anim_name + """</option>"""
-        i += 1
-    html_text += """</select>"""
-    return html_text
-
-
-def get_anim_sel_drop_downs():
+        self.wheel_speeds = (l_wheel_speed, r_wheel_speed, l_wheel_speed * 4, r_wheel_speed * 4)
+
+
+class RemoteControlSessions:
+    """Remote control sessions by serial. Loading /control reuses the robot's live session
+    (and its held connection) instead of building a new one; a session is kept while any page
+    has it open, counted by their /events streams, and torn down idle_timeout seconds after
+    the last page closed or did anything"""
+
+    def __init__(self, idle_timeout):
+        self.idle_timeout = idle_timeout
+        self.sessions = {}
+        self.lock = threading.Lock()
+        self.reaper = None
+
+    def get(self, serial):
+        with self.lock:
+            return self.sessions.get(serial)
+
+    def open(self, serial):
+        remote_control_vector = self.get(serial)
+        if remote_control_vector:
+            if connection_manager.get_connection(serial).robot is remote_control_vector.vector:
+                remote_control_vector.touch()
+                return remote_control_vector
+            # the connection broke and was rebuilt since, start over on the new one
+            self.close(serial)
+
+        robot = connection_manager.hold(serial, enable_camera_feed=True)
+        try:
+            robot.behavior.drive_off_charger()
+            status = current_status(serial)
+            remote_control_vector = RemoteControlVector(robot, serial, status.version if status else None)
+        except BaseException:
+            connection_manager.release(serial)
+            raise
+
+        with self.lock:
+            existing = self.sessions.get(serial)
+            if existing is None:
+                self.sessions[serial] = remote_control_vector
+                remote_control_vector.start()
+
+            if self.reaper is None:
+                self.reaper = threading.Thread(target=self.reap,
+                                               name='remote-control-reaper',
+                                               daemon=True)
+                self.reaper.start()
+
+        if existing:
+            # another request opened the session while this one connected
+            connection_manager.release(serial)
+            existing.touch()
+            return existing
+
+        if app.config['CAMERA_RECORDING']:
+            record_camera(remote_control_vector)
+        return remote_control_vector
+
+    def attach(self, remote_control_vector):
+        with self.lock:
+            remote_control_vector.viewers += 1
+            remote_control_vector.touch()
+
+    def detach(self, remote_control_vector):
+        with self.lock:
+            remote_control_vector.viewers -= 1
+            remote_control_vector.touch()
+
+    def close(self, serial):
+        with self.lock:
+            remote_control_vector = self.sessions.pop(serial, None)
+        if remote_control_vector is None:
+            return
+
+        remote_control_vector.stop()
+        recorder = flask_app.camera_recorders.get(serial)
+        if recorder:
+            recorder.attach(None)
+        connection_manager.release(serial)
+
+    def reap(self):
+        while True:
+            time.sleep(1)
+            now = time.time()
+            with self.lock:
+                idle = [serial for serial, remote_control_vector in self.sessions.items()
+                        if remote_control_vector.viewers <= 0 and
+                        now - remote_control_vector.last_used > self.idle_timeout]
+            for serial in idle:
+                self.close(serial)
+
+
+flask_app.remote_control_sessions = RemoteControlSessions(app.config['CONTROL_SESSION_IDLE_TIMEOUT'])
+
+
+# rendered animation dropdown options, keyed by robot OS version. The animation
+# list only changes with the OS version, so after the first /control load the
+# options come from here; only the selected one is rendered per dropdown.
+_anim_options_cache = {}
+
+
+def anim_option(i, anim_name, is_selected=False):
+    selected_text = ''' selected="selected"''' if is_selected else ""
+    return """<option value=""" + str(i) + selected_text + """>""" + anim_name + """</option>"""
+
+
+def get_anim_options(remote_control_vector):
+    options = _anim_options_cache.get(remote_control_vector.version)
+    if options is not None:
+        return options
+
+    options = [anim_option(i, anim_name) for i, anim_name in enumerate(remote_control_vector.anim_names)]
+
+    # without a version the list came straight from the robot, don't keep it
+    if remote_control_vector.version:
+        _anim_options_cache[remote_control_vector.version] = options
+    return options
+
+
+def get_anim_sel_drop_down(remote_control_vector, selectorIndex):
+    anim_index = remote_control_vector.anim_index_for_key[selectorIndex]
+    options = get_anim_options(remote_control_vector)
+
+    html_parts = ["""<select onchange="handleDropDownSelect(this)" name="animSelector""" + str(
+        selectorIndex) + """">"""]
+    if 0 <= anim_index < len(options):
+        html_parts += options[:anim_index]
+        html_parts.append(anim_option(anim_index, remote_control_vector.anim_names[anim_index], True))
+        html_parts += options[anim_index + 1:]
+    else:
+        html_parts += options
+    html_parts.append("""</select>""")
+    return "".join(html_parts)
+
+
+def get_anim_sel_drop_downs(remote_control_vector):
     html_text = ""
     for i in range(10):
         # list keys 1..9,0 as that's the layout on the keyboard
         key = i + 1 if (i < 9) else 0
-        html_text += str(key) + """: """ + get_anim_sel_drop_down(key) + """<br>"""
+        html_text += str(key) + """: """ + get_anim_sel_drop_down(remote_control_vector, key) + """<br>"""
     return html_text
 
 
@@ -378,13 +622,28 @@ def to_js_bool_string(bool_value):
     return "true" if bool_value else "false"
 
 
+# the page's requests use relative urls, so serving it under /robot/<serial>/
+# sends every keypress and frame request to that robot's session
 @flask_app.route("/control", methods=['POST', 'GET'])
 def control():
-    args = util.parse_command_args()
-    robot = anki_vector.AsyncRobot(args.serial, enable_camera_feed=True)
-    robot.connect()
-    robot.behavior.drive_off_charger()
-    flask_app.remote_control_vector = RemoteControlVector(robot)
+    return redirect(url_for('flask_app.robot_control',
+                            serial=selected_serial()))
+
+
+@flask_app.route("/robot/<serial>/control", methods=['POST', 'GET'])
+def robot_control(serial):
+    serial = robot_serial(serial)
+    try:
+        remote_control_vector = flask_app.remote_control_sessions.open(serial)
+    except RobotBusy as e:
+        # an application is driving the robot
+        flash(str(e), 'warning')
+        return redirect(url_for('main.home'))
+    except (anki_vector.exceptions.VectorNotFoundException,) + connection_errors:
+        # includes RobotUnavailable, while the robot's breaker is open
+        return redirect(url_for('error_pages.vector_not_found'))
+    except anki_vector.exceptions.VectorControlTimeoutException:
+        return redirect(url_for('error_pages.vector_stuck'))
 
     return """
     <html>
@@ -394,14 +653,14 @@ def control():
             <meta name="theme-color" content="#222D32">
             <link rel="stylesheet" href="https://maxcdn.bootstrapcdn.com/bootstrap/4.0.0/css/bootstrap.min.css" integrity="sha384-Gn5384xqQ1aoWXA+058RXPxPg6fy4IWvTNh0E263XmFcJlSAwiGgFAW/dAiS6JXm" crossorigin="anonymous">
             <link href='https://fonts.googleapis.com/css?family=Ubuntu' rel='stylesheet'>
-            <link rel="stylesheet" type="text/css" href="static/css/main.css">
+            <link rel="stylesheet" type="text/css" href="/static/css/main.css">
             <title>VectorCloud - Remote Control</title>
         </head>
         <body>
             <header class="site-header">
               <nav class="navbar navbar-expand-md navbar-dark bg-steel fixed-top">
                 <div class="container">
-                  <a class="navbar-brand mr-4" href="/home"><img src="static/icons/vectorcloud.svg" width="35" height="35" class="text-center align-top" data-toggle="tooltip" data-placement="auto" title="Home" alt=""></a>
+                  <a class="navbar-brand mr-4" href="/home"><img src="/static/icons/vectorcloud.svg" width="35" height="35" class="text-center align-top" data-toggle="tooltip" data-placement="auto" title="Home" alt=""></a>
                   <button class="navbar-toggler" type="button" data-toggle="collapse" data-target="#navbarToggle" aria-controls="navbarToggle" aria-expanded="false" aria-label="Toggle navigation">
                     <span class="navbar-toggler-icon"></span>
                   </button>
@@ -448,12 +707,12 @@ def control():
                         <h3>Play Animations</h3>
                         <b>0 .. 9</b> : Play Animation mapped to that key<br>
                         <h3>Talk</h3>
-                        <b>Space</b> : Say <input type="text" name="sayText" id="sayTextId" value="""" + flask_app.remote_control_vector.text_to_say + """" onchange=handleTextInput(this)>
+                        <b>Space</b> : Say <input type="text" name="sayText" id="sayTextId" value="""" + remote_control_vector.text_to_say + """" onchange=handleTextInput(this)>
                     </td>
                     <td width=30></td>
                     <td valign=top>
                     <h2>Animation key mappings:</h2>
-                    """ + get_anim_sel_drop_downs() + """<br>
+                    """ + get_anim_sel_drop_downs(remote_control_vector) + """<br>
                     </td>
                 </tr>
             </table>
@@ -478,6 +737,47 @@ def control():
                     xhr.send( JSON.stringify( dataSet ) );
                 }
 
+                // Input events are queued and sent together to "input" at most once every
+                // gInputBatchDelay ms, as compact arrays: ["kd"/"ku", keyCode, hasShift, hasAlt],
+                // ["mm", clientX, clientY], ["ml", isMouseLookEnabled], ["fp", isFreeplayEnabled],
+                // ["dd", itemName, selectedIndex] and ["st", textEntered]
+                var gInputEvents = [];
+                var gInputTimer = null;
+                var gInputBatchDelay = 20;
+
+                function flushInputEvents()
+                {
+                    gInputTimer = null;
+                    var events = gInputEvents;
+                    gInputEvents = [];
+                    postHttpRequest("input", events);
+                }
+
+                function queueInputEvent(inputEvent)
+                {
+                    var lastEvent = gInputEvents[gInputEvents.length - 1];
+                    if (inputEvent[0] == "mm" && lastEvent && lastEvent[0] == "mm") {
+                        // only the latest mouse position matters
+                        gInputEvents[gInputEvents.length - 1] = inputEvent;
+                    } else {
+                        gInputEvents.push(inputEvent);
+                    }
+                    if (gInputTimer == null) {
+                        gInputTimer = setTimeout(flushInputEvents, gInputBatchDelay);
+                    }
+                }
+
+                // The action queue is pushed over server-sent events, browsers without
+                // EventSource fall back to polling "updateVector"
+                if (window.EventSource && !gIsMicrosoftBrowser) {
+                    var gEvents = new EventSource("events");
+                    gEvents.onmessage = function(e) {
+                        document.getElementById("DebugInfoId").innerHTML = JSON.parse(e.data);
+                    };
+                } else {
+                    setInterval(updateVector , 60);
+                }
+
                 function updateVector()
                 {
                     console.log("Updating log")
@@ -499,7 +799,6 @@ def control():
                     xhr.open("POST", "updateVector", true);
                     xhr.send( null );
                 }
-                setInterval(updateVector , 60);
 
                 function updateButtonEnabledText(button, isEnabled)
                 {
@@ -510,16 +809,14 @@ def control():
                 {
                     gIsMouseLookEnabled = !gIsMouseLookEnabled;
                     updateButtonEnabledText(button, gIsMouseLookEnabled);
-                    isMouseLookEnabled = gIsMouseLookEnabled
-                    postHttpRequest("setMouseLookEnabled", {isMouseLookEnabled})
+                    queueInputEvent(["ml", gIsMouseLookEnabled])
                 }
 
                 function onFreeplayButtonClicked(button)
                 {
                     gIsFreeplayEnabled = !gIsFreeplayEnabled;
                     updateButtonEnabledText(button, gIsFreeplayEnabled);
-                    isFreeplayEnabled = gIsFreeplayEnabled
-                    postHttpRequest("setFreeplayEnabled", {isFreeplayEnabled})
+                    queueInputEvent(["fp", gIsFreeplayEnabled])
                 }
 
                 updateButtonEnabledText(document.getElementById("mouseLookId"), gIsMouseLookEnabled);
@@ -527,18 +824,21 @@ def control():
 
                 function handleDropDownSelect(selectObject)
                 {
-                    selectedIndex = selectObject.selectedIndex
-                    itemName = selectObject.name
-                    postHttpRequest("dropDownSelect", {selectedIndex, itemName});
+                    queueInputEvent(["dd", selectObject.name, selectObject.selectedIndex]);
                 }
 
                 function handleKeyActivity (e, actionType)
                 {
                     var keyCode  = (e.keyCode ? e.keyCode : e.which);
                     var hasShift = (e.shiftKey ? 1 : 0)
-                    var hasCtrl  = (e.ctrlKey  ? 1 : 0)
                     var hasAlt   = (e.altKey   ? 1 : 0)
 
+                    if (e.repeat)
+                    {
+                        // the server already knows the key is down
+                        return;
+                    }
+
                     if (actionType=="keyup")
                     {
                         if (keyCode == 80) // 'P'
@@ -553,26 +853,22 @@ def control():
                         }
                     }
 
-                    postHttpRequest(actionType, {keyCode, hasShift, hasCtrl, hasAlt})
+                    queueInputEvent([actionType == "keydown" ? "kd" : "ku", keyCode, hasShift, hasAlt])
                 }
 
                 function handleMouseActivity (e, actionType)
                 {
                     var clientX = e.clientX / document.body.clientWidth  // 0..1 (left..right)
                     var clientY = e.clientY / document.body.clientHeight // 0..1 (top..bottom)
-                    var isButtonDown = e.which && (e.which != 0) ? 1 : 0
-                    var deltaX = (gLastClientX >= 0) ? (clientX - gLastClientX) : 0.0
-                    var deltaY = (gLastClientY >= 0) ? (clientY - gLastClientY) : 0.0
                     gLastClientX = clientX
                     gLastClientY = clientY
 
-                    postHttpRequest(actionType, {clientX, clientY, isButtonDown, deltaX, deltaY})
+                    queueInputEvent(["mm", clientX, clientY])
                 }
 
                 function handleTextInput(textField)
                 {
-                    textEntered = textField.value
-                    postHttpRequest("sayText", {textEntered})
+                    queueInputEvent(["st", textField.value])
                 }
 
                 document.addEventListener("keydown", function(e) { handleKeyActivity(e, "keydown") } );
@@ -607,136 +903,300 @@ def control():
     """
 
 
-def get_annotated_image():
+def get_annotated_image(remote_control_vector):
     # TODO: Update to use annotated image (add annotate module)
-    image = flask_app.remote_control_vector.vector.camera.latest_image
+    image = remote_control_vector.vector.camera.latest_image
     if image is None:
         return _default_camera_image
 
     return image
 
 
-def streaming_video():
-    """Video streaming generator function"""
+def streaming_video(serial, image_format):
+    """Video streaming generator function, reads the robot's shared camera stream"""
+    session = StreamSession(len(app.config['CAMERA_STREAM_LEVELS']),
+                            1 / app.config['CAMERA_STREAM_FPS'])
+    last_stream = None
+    frame_id = None
     while True:
-        if flask_app.remote_control_vector:
-            image = get_annotated_image()
-
-            img_io = io.BytesIO()
-            image.save(img_io, 'PNG')
-            img_io.seek(0)
-            yield (b'--frame\r\n'
-                   b'Content-Type: image/png\r\n\r\n' + img_io.getvalue() + b'\r\n')
+        remote_control_vector = flask_app.remote_control_sessions.get(serial)
+        if remote_control_vector:
+            camera_stream = remote_control_vector.get_camera_stream(image_format, session.level)
+            if camera_stream is not last_stream:
+                # frame ids are per stream, take the next frame of the new one
+                last_stream = camera_stream
+                frame_id = None
+            new_frame_id, frame = camera_stream.wait_for_frame(frame_id, timeout=1)
+            if frame is not None and new_frame_id != frame_id:
+                frame_id = new_frame_id
+                started = time.time()
+                yield (b'--frame\r\n'
+                       b'Content-Type: ' + camera_stream.content_type.encode() + b'\r\n\r\n' +
+                       frame + b'\r\n')
+                # the server resumes the generator once the frame is written
+                session.record_write(time.time() - started)
+            elif camera_stream.stopped:
+                # replaced by a new /control session, pick that one up
+                time.sleep(.1)
         else:
             time.sleep(.1)
 
 
-def serve_single_image():
-    if flask_app.remote_control_vector:
-        image = get_annotated_image()
+def serve_single_image(serial):
+    remote_control_vector = flask_app.remote_control_sessions.get(serial)
+    if remote_control_vector:
+        image = get_annotated_image(remote_control_vector)
         if image:
-            return serve_pil_image(image)
+            return serve_pil_image(image, serve_as_jpeg=single_image_as_jpeg(),
+                                   jpeg_quality=app.config['CAMERA_STREAM_LEVELS'][0][1])
 
     return serve_pil_image(_default_camera_image)
 
 
+def single_image_as_jpeg():
+    # the single image fallback is for browsers without mjpeg (or WebP)
+    # support, so anything lossy is served as JPEG
+    return app.config['CAMERA_STREAM_FORMAT'].upper() != 'PNG'
+
+
 def is_microsoft_browser(req):
     agent = req.user_agent.string
     return 'Edge/' in agent or 'MSIE ' in agent or 'Trident/' in agent
 
 
-@flask_app.route("/vectorImage")
-def handle_vectorImage():
+def record_camera(remote_control_vector):
+    serial = remote_control_vector.serial
+    recorder = flask_app.camera_recorders.get(serial)
+    if recorder is None:
+        recorder = CameraRecorder(
+            os.path.join(app.config['CAMERA_RECORDING_FOLDER'], serial),
+            segment_count=app.config['CAMERA_RECORDING_SEGMENTS'],
+            segment_bytes=app.config['CAMERA_RECORDING_SEGMENT_BYTES'],
+            segment_seconds=app.config['CAMERA_RECORDING_SEGMENT_SECONDS'])
+        flask_app.camera_recorders[serial] = recorder
+    # clips are exported as motion jpeg, so the recording is always JPEG
+    recorder.attach(remote_control_vector.get_camera_stream('JPEG'))
+
+
+@flask_app.route("/recording.mjpeg", defaults={'serial': None})
+@flask_app.route("/robot/<serial>/recording.mjpeg")
+def handle_recording(serial):
+    """Exports the recorded camera frames between the start and end query parameters
+    (unix timestamps, the last minute by default) as a motion jpeg clip, which plays in
+    VLC or ffplay. Frames are streamed straight out of the recording segments"""
+    serial = robot_serial(serial)
+    recorder = flask_app.camera_recorders.get(serial)
+    if recorder is None:
+        abort(404)
+    end = request.args.get('end', time.time(), type=float)
+    start = request.args.get('start', end - 60, type=float)
+    response = Response(recorder.clip(start, end), mimetype='video/x-motion-jpeg')
+    response.headers['Content-Disposition'] = \
+        'attachment; filename=vector-%s-%d.mjpeg' % (serial, start)
+    return response
+
+
+@flask_app.route("/vectorImage", defaults={'serial': None})
+@flask_app.route("/robot/<serial>/vectorImage")
+def handle_vectorImage(serial):
+    # the stream outlives the request, so the serial is resolved up front
+    serial = robot_serial(serial)
     if is_microsoft_browser(request):
-        return serve_single_image()
-    return stream_video(streaming_video)
+        return serve_single_image(serial)
+    image_format = negotiate_format(app.config['CAMERA_STREAM_FORMAT'],
+                                    list(request.accept_mimetypes.values()))
+    return stream_video(lambda: streaming_video(serial, image_format))
 
 
-def handle_key_event(key_request, is_key_down):
+def handle_key_event(key_request, is_key_down, serial=None):
     message = json.loads(key_request.data.decode("utf-8"))
-    if flask_app.remote_control_vector:
-        flask_app.remote_control_vector.handle_key(key_code=(message['keyCode']), is_shift_down=message['hasShift'],
-                                                   is_alt_down=message['hasAlt'], is_key_down=is_key_down)
+    remote_control_vector = get_remote_control_vector(serial)
+    if remote_control_vector:
+        remote_control_vector.handle_key(key_code=(message['keyCode']), is_shift_down=message['hasShift'],
+                                         is_alt_down=message['hasAlt'], is_key_down=is_key_down)
     return ""
 
 
-@flask_app.route('/mousemove', methods=['POST'])
-def handle_mousemove():
+@flask_app.route('/mousemove', methods=['POST'], defaults={'serial': None})
+@flask_app.route('/robot/<serial>/mousemove', methods=['POST'])
+def handle_mousemove(serial):
     """Called from Javascript whenever mouse moves"""
     message = json.loads(request.data.decode("utf-8"))
-    if flask_app.remote_control_vector:
-        flask_app.remote_control_vector.handle_mouse(
+    remote_control_vector = get_remote_control_vector(serial)
+    if remote_control_vector:
+        remote_control_vector.handle_mouse(
             mouse_x=(message['clientX']), mouse_y=message['clientY'])
     return ""
 
 
-@flask_app.route('/setMouseLookEnabled', methods=['POST'])
-def handle_setMouseLookEnabled():
+@flask_app.route('/setMouseLookEnabled', methods=['POST'], defaults={'serial': None})
+@flask_app.route('/robot/<serial>/setMouseLookEnabled', methods=['POST'])
+def handle_setMouseLookEnabled(serial):
     """Called from Javascript whenever mouse-look mode is toggled"""
     message = json.loads(request.data.decode("utf-8"))
-    if flask_app.remote_control_vector:
-        flask_app.remote_control_vector.set_mouse_look_enabled(
+    remote_control_vector = get_remote_control_vector(serial)
+    if remote_control_vector:
+        remote_control_vector.set_mouse_look_enabled(
             is_mouse_look_enabled=message['isMouseLookEnabled'])
     return ""
 
 
-@flask_app.route('/setFreeplayEnabled', methods=['POST'])
-def handle_setFreeplayEnabled():
+@flask_app.route('/setFreeplayEnabled', methods=['POST'], defaults={'serial': None})
+@flask_app.route('/robot/<serial>/setFreeplayEnabled', methods=['POST'])
+def handle_setFreeplayEnabled(serial):
     """Called from Javascript whenever freeplay mode is toggled on/off"""
     message = json.loads(request.data.decode("utf-8"))
-    if flask_app.remote_control_vector:
-        isFreeplayEnabled = message['isFreeplayEnabled']
-        connection = flask_app.remote_control_vector.vector.conn
-        connection.request_control(enable=(not isFreeplayEnabled))
+    remote_control_vector = get_remote_control_vector(serial)
+    if remote_control_vector:
+        set_freeplay_enabled(remote_control_vector, message['isFreeplayEnabled'])
     return ""
 
 
-@flask_app.route('/keydown', methods=['POST'])
-def handle_keydown():
+@flask_app.route('/keydown', methods=['POST'], defaults={'serial': None})
+@flask_app.route('/robot/<serial>/keydown', methods=['POST'])
+def handle_keydown(serial):
     """Called from Javascript whenever a key is down (note: can generate repeat calls if held down)"""
-    return handle_key_event(request, is_key_down=True)
+    return handle_key_event(request, is_key_down=True, serial=serial)
 
 
-@flask_app.route('/keyup', methods=['POST'])
-def handle_keyup():
+@flask_app.route('/keyup', methods=['POST'], defaults={'serial': None})
+@flask_app.route('/robot/<serial>/keyup', methods=['POST'])
+def handle_keyup(serial):
     """Called from Javascript whenever a key is released"""
-    return handle_key_event(request, is_key_down=False)
+    return handle_key_event(request, is_key_down=False, serial=serial)
 
 
-@flask_app.route('/dropDownSelect', methods=['POST'])
-def handle_dropDownSelect():
+@flask_app.route('/dropDownSelect', methods=['POST'], defaults={'serial': None})
+@flask_app.route('/robot/<serial>/dropDownSelect', methods=['POST'])
+def handle_dropDownSelect(serial):
     """Called from Javascript whenever an animSelector dropdown menu is selected (i.e. modified)"""
     message = json.loads(request.data.decode("utf-8"))
 
     item_name_prefix = "animSelector"
     item_name = message['itemName']
 
-    if flask_app.remote_control_vector and item_name.startswith(item_name_prefix):
+    remote_control_vector = get_remote_control_vector(serial)
+    if remote_control_vector and item_name.startswith(item_name_prefix):
         item_name_index = int(item_name[len(item_name_prefix):])
-        flask_app.remote_control_vector.set_anim(item_name_index, message['selectedIndex'])
+        remote_control_vector.set_anim(item_name_index, message['selectedIndex'])
 
     return ""
 
 
-@flask_app.route('/sayText', methods=['POST'])
-def handle_sayText():
+@flask_app.route('/sayText', methods=['POST'], defaults={'serial': None})
+@flask_app.route('/robot/<serial>/sayText', methods=['POST'])
+def handle_sayText(serial):
     """Called from Javascript whenever the saytext text field is modified"""
     message = json.loads(request.data.decode("utf-8"))
-    if flask_app.remote_control_vector:
-        flask_app.remote_control_vector.text_to_say = message['textEntered']
+    remote_control_vector = get_remote_control_vector(serial)
+    if remote_control_vector:
+        remote_control_vector.text_to_say = message['textEntered']
     return ""
 
 
-@flask_app.route('/updateVector', methods=['POST'])
-def handle_updateVector():
-    if flask_app.remote_control_vector:
-        flask_app.remote_control_vector.update()
-        action_queue_text = ""
-        i = 1
-        for action in flask_app.remote_control_vector.action_queue:
-            action_queue_text += str(i) + ": " + \
-                flask_app.remote_control_vector.action_to_text(action) + "<br>"
-            i += 1
+def action_queue_text(remote_control_vector, running, queued):
+    """The running and queued actions as html"""
+    action_queue_text = ""
+    if running:
+        action_queue_text += "Running: " + \
+            remote_control_vector.action_to_text(running) + "<br>"
+    i = 1
+    for action in queued:
+        action_queue_text += str(i) + ": " + \
+            remote_control_vector.action_to_text(action) + "<br>"
+        i += 1
+
+    return "Action Queue:<br>" + action_queue_text + "\n"
+
 
-        return "Action Queue:<br>" + action_queue_text + "\n"
+@flask_app.route('/updateVector', methods=['POST'], defaults={'serial': None})
+@flask_app.route('/robot/<serial>/updateVector', methods=['POST'])
+def handle_updateVector(serial):
+    """Polled by browsers without server-sent events instead of /events"""
+    remote_control_vector = get_remote_control_vector(serial)
+    if remote_control_vector:
+        _, running, queued = remote_control_vector.actions.snapshot()
+        return action_queue_text(remote_control_vector, running, queued)
     return ""
+
+
+def apply_input_event(remote_control_vector, input_event):
+    """Applies one compact input event from the control page (see queueInputEvent)"""
+    event_type = input_event[0]
+    if event_type in ('kd', 'ku'):
+        remote_control_vector.handle_key(key_code=input_event[1], is_shift_down=input_event[2],
+                                         is_alt_down=input_event[3], is_key_down=(event_type == 'kd'))
+    elif event_type == 'mm':
+        remote_control_vector.handle_mouse(mouse_x=input_event[1], mouse_y=input_event[2])
+    elif event_type == 'ml':
+        remote_control_vector.set_mouse_look_enabled(is_mouse_look_enabled=input_event[1])
+    elif event_type == 'fp':
+        set_freeplay_enabled(remote_control_vector, input_event[1])
+    elif event_type == 'dd':
+        item_name_prefix = "animSelector"
+        item_name = input_event[1]
+        if item_name.startswith(item_name_prefix):
+            item_name_index = int(item_name[len(item_name_prefix):])
+            remote_control_vector.set_anim(item_name_index, input_event[2])
+    elif event_type == 'st':
+        remote_control_vector.text_to_say = input_event[1]
+
+
+@flask_app.route('/input', methods=['POST'], defaults={'serial': None})
+@flask_app.route('/robot/<serial>/input', methods=['POST'])
+def handle_input(serial):
+    """Called from Javascript with every batch of queued input events, in the order they happened"""
+    input_events = json.loads(request.data.decode("utf-8"))
+    remote_control_vector = get_remote_control_vector(serial)
+    if remote_control_vector:
+        for input_event in input_events:
+            apply_input_event(remote_control_vector, input_event)
+    return ""
+
+
+def control_events(serial):
+    """Server-sent events generator: sends the action queue every time the
+    robot's action executor changes it. While the stream is open the page
+    counts as a viewer of the session, so the session isn't torn down"""
+    sessions = flask_app.remote_control_sessions
+    attached = None
+    version = None
+    try:
+        while True:
+            remote_control_vector = sessions.get(serial)
+            if remote_control_vector is not attached:
+                if attached:
+                    sessions.detach(attached)
+                if remote_control_vector:
+                    sessions.attach(remote_control_vector)
+                attached = remote_control_vector
+                version = None
+            if remote_control_vector is None:
+                # there is no session until /control is loaded again
+                time.sleep(_keepalive_interval)
+                yield ': keepalive\n\n'
+                continue
+            new_version, running, queued = remote_control_vector.actions.wait_for_change(
+                version, timeout=_keepalive_interval)
+            if new_version != version:
+                version = new_version
+                text = action_queue_text(remote_control_vector, running, queued)
+                yield 'data: ' + json.dumps(text) + '\n\n'
+            else:
+                # lets the server notice a closed page
+                yield ': keepalive\n\n'
+    # the server closes the generator when the page goes away
+    finally:
+        if attached:
+            sessions.detach(attached)
+
+
+@flask_app.route('/events', defaults={'serial': None})
+@flask_app.route('/robot/<serial>/events')
+def handle_events(serial):
+    # the stream outlives the request, so the serial is resolved up front
+    serial = robot_serial(serial)
+    response = Response(control_events(serial), mimetype='text/event-stream')
+    response.headers['Cache-Control'] = 'no-cache'
+    response.headers['X-Accel-Buffering'] = 'no'
+    return response
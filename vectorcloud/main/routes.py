@@ -4,13 +4,22 @@ import os
 import sys
 import time
 import platform
-from flask import render_template, url_for, redirect, flash, request, Blueprint
+from flask import render_template, url_for, redirect, flash, request,\
+    Blueprint, jsonify, abort, session
 from flask_login import current_user
 from vectorcloud.main.forms import CommandForm, SearchForm
 from vectorcloud.models import Command, User, Status, Application, Output,\
-    ApplicationStore, Settings
-from vectorcloud.main.utils import robot_do, get_stats
+    ApplicationStore, Settings, upgrade_database
+from vectorcloud.main.utils import queue_commands, get_stats,\
+    current_status, selected_serial, status_poller, broadcast_commands,\
+    queue_dock_cube, robot_serial
 from vectorcloud.application_store.utils import temp_folder
+from vectorcloud.robot_system.telemetry import history, metrics
+from vectorcloud.robot_system.jobs import job_queue
+from vectorcloud.robot_system.sdk_config import sdk_config
+from vectorcloud.application_system.runner import interpreter_pool,\
+    process_supervisor
+from vectorcloud.application_system.schedules import schedule_runner
 from vectorcloud import db, app
 
 try:
@@ -29,13 +38,25 @@ vectorcloud_sdk_version = "0.5.1"
 sdk_version = anki_vector.__version__
 operating_system = platform.system()
 
-# create all tables in the database if they don't exist
+# create all tables in the database if they don't exist, and bring older
+# tables up to date
 db.create_all()
+upgrade_database()
+
+# background applications from a previous run are no longer ours to track
+process_supervisor.reconcile()
+
 settings = Settings()
 db.session.add(settings)
 db.session.commit()
 
 
+# scheduled applications run from the first request (to any page) on
+@main.before_app_request
+def start_schedules():
+    schedule_runner.start()
+
+
 # blocks access to all pages (except public routes) unless the user is
 # signed in.
 @main.before_request
@@ -100,6 +121,9 @@ def home():
     db.session.query(Output).delete()
     db.session.commit()
 
+    # the applications are about to be listed, have workers ready to run them
+    interpreter_pool.warm()
+
     app_list = Application.query.all()
     store_app_list = ApplicationStore.query.all()
 
@@ -159,7 +183,7 @@ def home():
     if err_msg:
         return redirect(url_for('error_pages.' + err_msg))
 
-    vector_status = Status.query.first()
+    vector_status = current_status()
     settings = Settings.query.first()
 
     if settings.view == 'card':
@@ -201,14 +225,50 @@ def set_list_view():
     return redirect(url_for('main.home'))
 
 
-# executes all commmands in the command table(if present), redirects to home.
-@main.route("/execute_commands", methods=['GET', 'POST'])
-def execute_commands():
+# answers a route that queued a job: json clients get the job straight away
+# (poll /job/<id> for progress), browsers get a flash message and go home.
+def job_response(job, message):
+    if request.accept_mimetypes.best == 'application/json':
+        return jsonify(job.to_dict()), 202
+
+    flash(message, 'success')
+    return redirect(url_for('main.home'))
+
+
+# queues all commmands in the command table(if present), redirects to home.
+# Staged commands run at low priority, behind docking and undocking.
+# Like the other robot routes below, this runs on the selected robot, or on
+# the robot given in the url when called as /robot/<serial>/execute_commands.
+@main.route("/execute_commands", methods=['GET', 'POST'],
+            defaults={'serial': None})
+@main.route("/robot/<serial>/execute_commands", methods=['GET', 'POST'])
+def execute_commands(serial):
+    serial = robot_serial(serial)
     robot_commands = Command.query.all()
     if robot_commands:
-        err_msg = robot_do()
-        if err_msg:
-            return redirect(url_for('error_pages.' + err_msg))
+        job = queue_commands('Commands', serial, priority='low')
+        return job_response(job, 'Commands sent to Vector!')
+
+    else:
+        flash('No command staged!', 'warning')
+
+    return redirect(url_for('main.home'))
+
+
+# queues all commands in the command table on several robots at once: the
+# ones given as serial= parameters, or every robot in sdk_config.ini.
+@main.route("/broadcast_commands", methods=['GET', 'POST'])
+def broadcast():
+    serials = request.values.getlist('serial')
+    if not serials:
+        serials = [profile.serial for profile in sdk_config.profiles()]
+
+    if not serials or not all(sdk_config.get(serial) for serial in serials):
+        abort(400)
+
+    if Command.query.first():
+        job = broadcast_commands('Broadcast', serials, priority='low')
+        return job_response(job, 'Commands sent to %d robots!' % len(serials))
 
     else:
         flash('No command staged!', 'warning')
@@ -224,79 +284,156 @@ def clear_commands():
     return redirect(url_for('main.home'))
 
 
-# adds undock command to the command table, runs robot_do(), redirects to home.
+# adds undock command to the command table, queues it, redirects to home.
 # this is a great example of how you can queue commands in the command table
-# and execute them using robot_do (url /execute_commands)
-@main.route("/undock")
-def undock():
+# and execute them using queue_commands (url /execute_commands)
+@main.route("/undock", defaults={'serial': None})
+@main.route("/robot/<serial>/undock")
+def undock(serial):
+    serial = robot_serial(serial)
     db.session.query(Command).delete()
     robot_command = Command(command='robot.behavior.drive_off_charger()')
     db.session.add(robot_command)
     db.session.commit()
 
-    err_msg = robot_do(override_output='Undock Command Complete!')
-    if err_msg:
-        db.session.query(Command).delete()
-        db.session.commit()
-        return redirect(url_for('error_pages.' + err_msg))
-
-    err_msg = get_stats(force=True)
-    if err_msg:
-        return redirect(url_for('error_pages.' + err_msg))
-
-    return redirect(url_for('main.home'))
+    job = queue_commands('Undock', serial,
+                         override_output='Undock Command Complete!',
+                         refresh=True)
+    return job_response(job, 'Undocking...')
 
 
-# adds dock command to the command table, runs robot_do(), redirects to home.
-@main.route("/dock")
-def dock():
+# adds dock command to the command table, queues it, redirects to home.
+# Docking goes ahead of everything else waiting for the robot, so a robot
+# that is running low can always be sent back to its charger.
+@main.route("/dock", defaults={'serial': None})
+@main.route("/robot/<serial>/dock")
+def dock(serial):
+    serial = robot_serial(serial)
     db.session.query(Command).delete()
     robot_command = Command(command='robot.behavior.drive_on_charger()')
     db.session.add(robot_command)
     db.session.commit()
 
-    err_msg = robot_do(override_output='Dock Command Complete!')
-    if err_msg:
-        db.session.query(Command).delete()
-        db.session.commit()
-        return redirect(url_for('error_pages.' + err_msg))
-
-    err_msg = get_stats(force=True)
-    if err_msg:
-        return redirect(url_for('error_pages.' + err_msg))
-
-    return redirect(url_for('main.home'))
+    job = queue_commands('Dock', serial,
+                         override_output='Dock Command Complete!',
+                         refresh=True, priority='high')
+    return job_response(job, 'Docking...')
 
 # connects to cube to get data
 
 
-@main.route("/connect_cube")
-def connect_cube():
+@main.route("/connect_cube", defaults={'serial': None})
+@main.route("/robot/<serial>/connect_cube")
+def connect_cube(serial):
+    serial = robot_serial(serial)
     db.session.query(Command).delete()
     robot_command = Command(command='robot.world.connect_cube()')
     db.session.add(robot_command)
     db.session.commit()
 
-    err_msg = robot_do(override_output='Cube Connected!')
-    if err_msg:
-        return redirect(url_for('error_pages.' + err_msg))
+    job = queue_commands('Connect Cube', serial,
+                         override_output='Cube Connected!', refresh=True)
+    return job_response(job, 'Connecting to cube...')
 
-    return redirect(url_for('main.home'))
 
+# progress and result of one queued job as json
+@main.route("/job/<job_id>")
+def job_status(job_id):
+    job = job_queue.get(job_id)
+    if job is None:
+        abort(404)
 
-# sends the following commands to Vector to attempt to pick up his cube
-# redirects to home when done.
-@main.route("/dock_cube")
-def dock_cube():
-    args = anki_vector.util.parse_command_args()
-    with anki_vector.Robot(args.serial) as robot:
-        robot.behavior.drive_off_charger()
-        cube = robot.world.connect_cube()
-        if cube:
-            robot.behavior.dock_with_cube(cube)
-            robot.behavior.set_lift_height(100.0)
-            time.sleep(5)
-            robot.behavior.set_lift_height(0,  max_speed=10.0)
-            robot.world.disconnect_cube()
-            flash('Cube picked up!', 'success')
-    return redirect(url_for('main.home'))
+    return jsonify(job.to_dict())
+
+
+# every job that is still queued or running, plus the recently finished ones
+@main.route("/jobs")
+def jobs():
+    all_jobs = job_queue.all()
+    return jsonify(
+        active=[job.to_dict() for job in all_jobs if job.is_active()],
+        finished=[job.to_dict() for job in all_jobs if not job.is_active()])
+
+
+# queues the commands that make Vector pick up his cube, redirects to home.
+@main.route("/dock_cube", defaults={'serial': None})
+@main.route("/robot/<serial>/dock_cube")
+def dock_cube(serial):
+    serial = robot_serial(serial)
+    job = queue_dock_cube(serial)
+    return job_response(job, 'Picking up the cube...')
+
+
+# returns the status history of the selected robot (or of serial) between the
+# start and end query parameters (unix timestamps, defaulting to the last hour)
+# as json. Pass metric= one or more times to limit the metrics returned.
+@main.route("/status_history", defaults={'serial': None})
+@main.route("/robot/<serial>/status_history")
+def status_history(serial):
+    serial = robot_serial(serial)
+
+    end = request.args.get('end', time.time(), type=float)
+    start = request.args.get('start', end - 60 * 60, type=float)
+    metric_names = request.args.getlist('metric') or None
+
+    if metric_names and not set(metric_names).issubset(metrics):
+        abort(400)
+
+    return jsonify(history(serial, start, end, metric_names))
+
+
+# ------------------------------------------------------------------------------
+# Fleet routes
+# ------------------------------------------------------------------------------
+
+# every robot in sdk_config.ini, made available to all templates so the layout
+# can offer to switch between them
+@main.app_context_processor
+def inject_fleet():
+    if not current_user.is_authenticated:
+        return {}
+
+    return dict(fleet=sdk_config.profiles(), selected_serial=selected_serial())
+
+
+# picks the robot shown in the header and used by the robot routes
+@main.route("/select_robot/<serial>")
+def select_robot(serial):
+    if sdk_config.get(serial) is None:
+        abort(404)
+
+    session['serial'] = serial
+    get_stats(serial=serial)
+    return redirect(request.referrer or url_for('main.home'))
+
+
+# latest status and last poll error of every robot in the fleet as json
+@main.route("/fleet")
+def fleet_status():
+    get_stats()
+    statuses = {status.serial: status for status in Status.query.all()}
+    robots = []
+
+    for profile in sdk_config.profiles():
+        status = statuses.get(profile.serial)
+        robot = {'serial': profile.serial,
+                 'name': profile.name,
+                 'ip': profile.ip,
+                 'error': status_poller.errors.get(profile.serial),
+                 'status': None}
+
+        if status is not None:
+            robot['status'] = {
+                'version': status.version,
+                'battery_voltage': status.battery_voltage,
+                'battery_level': status.battery_level,
+                'status_charging': status.status_charging,
+                'cube_battery_level': status.cube_battery_level,
+                'cube_id': status.cube_id,
+                'cube_battery_volts': status.cube_battery_volts,
+                'cube_connected': status.cube_connected,
+                'timestamp': status.timestamp}
+
+        robots.append(robot)
+
+    return jsonify(robots=robots, selected=selected_serial())
@@ -1,18 +1,24 @@
 #!/usr/bin/env python3
 
-import os
 import sys
 import time
+from concurrent.futures import ThreadPoolExecutor
 from grpc._channel import _Rendezvous
-from pathlib import Path
-from flask import flash
-from configparser import ConfigParser
+from flask import session, abort
 from vectorcloud.models import Command, Output, Status
-from vectorcloud import db
+from vectorcloud import app, db
+from vectorcloud.robot_system.connection import connection_manager, resolve,\
+    default_serial, connection_errors
+from vectorcloud.robot_system.poller import StatusPoller
+from vectorcloud.robot_system.commands import compile_command, run_plan,\
+    CommandError
+from vectorcloud.robot_system.jobs import job_queue, JobError
+from vectorcloud.robot_system.scheduler import RobotBusy
+from vectorcloud.robot_system.sdk_config import sdk_config
+from vectorcloud.robot_system.telemetry import record_sample, compact
 
 try:
     import anki_vector
-    from anki_vector.util import degrees, radians
 except ImportError:
     sys.exit("Cannot import from anki_vector: Install per Anki instructions")
 
@@ -24,126 +30,405 @@ def public_route(decorated_function):
     return decorated_function
 
 
-# initiate config parser
-config = ConfigParser()
-
-
 # ------------------------------------------------------------------------------
 # Main functions
 # ------------------------------------------------------------------------------
 
-# get_stats(): this function gets the results of robot.get_version_state() &
-# robot.get_battery_state() and stores it to the status table in the database
-# it clears the table at the begining of the function and leaves the data there
-# until it is called again.
-def get_stats(force=False):
+# fetch_status(): this function gets the results of
+# robot.get_version_state() & robot.get_battery_state() for one robot and
+# returns them as an unsaved Status row, or None and the error page name if
+# the robot couldn't be reached. Both requests are sent before waiting on
+# either, so a refresh costs one round trip rather than two. It runs on the
+# fleet pool so it only talks to the robot, never to the database.
+def fetch_status(profile):
     try:
-        status = Status.query.first()
-        timestamp = time.time()
+        with connection_manager.lease(profile.serial,
+                                      behavior_control=False) as robot:
 
-        if status is None:
-            new_stamp = timestamp - 20
-            status = Status(timestamp=new_stamp)
-            db.session.add(status)
-            db.session.commit()
-
-        elif timestamp - status.timestamp > 15 or force is True:
-
-            # get robot name and ip from config file
-            home = Path.home()
-            sdk_config_file = os.path.join(home, '.anki_vector', 'sdk_config.ini')
-            f = open(sdk_config_file)
-            serial = f.readline()
-            serial = serial.replace(']', '')
-            serial = serial.replace('[', '')
-            serial = serial.replace('\n', '')
-            f.close()
-            config.read(sdk_config_file)
-            ip = config.get(serial, 'ip')
-            name = config.get(serial, 'name')
-
-            # get results from battery state and version state,
-            # save to database
-            args = anki_vector.util.parse_command_args()
-            with anki_vector.Robot(args.serial,
-                                   requires_behavior_control=False,
-                                   cache_animation_list=False) as robot:
-
-                version_state = robot.get_version_state()
-                battery_state = robot.get_battery_state()
-
-                db.session.query(Status).delete()
-                status = Status(version=version_state.os_version,
-                                battery_voltage=battery_state.battery_volts,
-                                battery_level=battery_state.battery_level,
-                                status_charging=battery_state.is_on_charger_platform,
-                                cube_battery_level=battery_state.cube_battery.level,
-                                cube_id=battery_state.cube_battery.factory_id,
-                                cube_battery_volts=battery_state.
-                                cube_battery.battery_volts,
-                                timestamp=timestamp,
-                                ip=ip,
-                                name=name)
-                db.session.add(status)
-                db.session.commit()
+            version_future = robot.get_version_state()
+            battery_future = robot.get_battery_state()
 
-        else:
-            status.timestamp = timestamp
-            db.session.merge(status)
-            db.session.commit()
+            # kept up to date by the SDK's event stream, no request needed
+            cube_connected = robot.world.connected_light_cube is not None
+
+            version_state = resolve(version_future)
+            battery_state = resolve(battery_future)
 
+    # the connection manager has already dropped the dead channel, the next
+    # poll reconnects. Keep whatever the last poll reported until then.
     except _Rendezvous:
-        time.sleep(3)
-        get_stats(force=True)
+        return None, status_poller.errors.get(profile.serial)
 
     except anki_vector.exceptions.VectorNotFoundException:
-        return 'vector_not_found'
+        return None, 'vector_not_found'
 
     except anki_vector.exceptions.VectorControlTimeoutException:
-        return 'vector_stuck'
+        return None, 'vector_stuck'
+
+    # any other failure is this robot's alone, it mustn't abort the refresh
+    # of the rest of the fleet
+    except connection_errors:
+        return None, 'vector_not_found'
+
+    except Exception:
+        app.logger.exception('Status refresh of %s failed', profile.serial)
+        return None, 'vector_not_found'
+
+    status = Status(serial=profile.serial,
+                    version=version_state.os_version,
+                    battery_voltage=battery_state.battery_volts,
+                    battery_level=battery_state.battery_level,
+                    status_charging=battery_state.is_on_charger_platform,
+                    cube_battery_level=battery_state.cube_battery.level,
+                    cube_id=battery_state.cube_battery.factory_id,
+                    cube_battery_volts=battery_state.
+                    cube_battery.battery_volts,
+                    cube_connected=cube_connected,
+                    timestamp=time.time(),
+                    ip=profile.ip,
+                    name=profile.name)
+    return status, None
+
+
+fleet_pool = ThreadPoolExecutor(max_workers=app.config['FLEET_POLL_WORKERS'],
+                                thread_name_prefix='fleet-poll')
+
+
+# refresh_status(): polls every robot in sdk_config.ini at the same time, so a
+# refresh takes as long as the slowest robot rather than the sum of them, then
+# stores one row per robot in the status table with a copy appended to the
+# status history. It is run by status_poller on its own thread every
+# STATUS_POLL_INTERVAL seconds and returns the error page name for each robot
+# that couldn't be reached. Routes should call get_stats() instead.
+def refresh_status():
+    profiles = sdk_config.profiles()
+    results = fleet_pool.map(fetch_status, profiles)
+    errors = {}
+
+    for profile, (status, error) in zip(profiles, results):
+        if error:
+            errors[profile.serial] = error
+
+        if status is not None:
+            db.session.query(Status).filter_by(serial=profile.serial).delete()
+            db.session.add(status)
+            record_sample(status)
+
+    # robots that have been removed from the config
+    serials = [profile.serial for profile in profiles]
+    db.session.query(Status).\
+        filter(Status.serial.notin_(serials)).\
+        delete(synchronize_session=False)
+
+    db.session.commit()
+    compact()
+    return errors
+
+
+status_poller = StatusPoller(refresh_status,
+                             app.config['STATUS_POLL_INTERVAL'])
+
+# refresh as soon as an unreachable robot answers a background probe again
+connection_manager.recovered.append(lambda serial: status_poller.poll_now())
+
+
+# selected_serial(): the robot the user is looking at. It is picked with
+# /select_robot/<serial> and kept in the session, falling back to the default
+# robot if nothing (or a robot that has since been removed) was picked.
+def selected_serial():
+    serial = session.get('serial')
+
+    if serial is not None and sdk_config.get(serial) is not None:
+        return serial
 
+    return default_serial()
+
+
+# robot_serial(): the robot a /robot/<serial>/... route runs on. A serial in
+# the url has to be a robot in sdk_config.ini, anything else is a 404 so it
+# never gets a connection (or a breaker) of its own. Routes called without
+# one run on the selected robot.
+def robot_serial(serial):
+    if serial is None:
+        return selected_serial()
+
+    if sdk_config.get(serial) is None:
+        abort(404)
+    return serial
+
+
+# current_status(): the status row of the selected robot (or of serial)
+def current_status(serial=None):
+    if serial is None:
+        serial = selected_serial()
+
+    return Status.query.filter_by(serial=serial).first()
+
+
+# get_stats(): routes call this before reading the status table. It never
+# talks to the robot, it makes sure the status poller is running and returns
+# the error page name from the last poll of the selected robot (or of serial),
+# if any. force=True asks the poller to refresh right away, e.g. after
+# docking, but still doesn't wait for it.
+def get_stats(force=False, serial=None):
+    if serial is None:
+        serial = selected_serial()
+
+    if serial is None:
+        return 'vector_not_found'
+
+    status = current_status(serial)
+
+    if status is None:
+        # take over the single row written before robots were told apart by
+        # serial, if there is one, so there is something to show until the
+        # first poll comes back
+        status = Status.query.filter_by(serial=None).first()
+        if status is None:
+            status = Status(timestamp=time.time())
+            db.session.add(status)
+
+        status.serial = serial
+        db.session.commit()
+        force = True
+
+    if force is True:
+        status_poller.poll_now()
+
+    else:
+        status_poller.start()
+
+    return status_poller.errors.get(serial)
+
+
+# queue_commands(): hands every command in the command table to the job queue
+# and clears the table, returning the Job straight away. The commands run on
+# the selected robot unless serial is given. If there are commands
+# in the command table, all you have to do to execute them is redirect to
+# /execute_commands/ and this function will be called. Output is saved to the
+# output table when the job finishes, and flashed on the next home page load.
+# override_output replaces the per-command output with one message and
+# refresh=True asks the status poller to refresh once the commands are done.
+# priority orders the job in the job queue and its claim on the robot (see
+# robot_system/scheduler.py).
+def queue_commands(name, serial=None, override_output=None, refresh=False,
+                   priority='normal'):
+    if serial is None:
+        serial = selected_serial()
+
+    command_texts = [str(command) for command in Command.query.all()]
+    db.session.query(Command).delete()
+    db.session.commit()
+    return job_queue.submit(name, commands_job, serial, command_texts,
+                            override_output, refresh, priority=priority)
+
+
+# commands_job(): runs on a job worker. Every command is compiled (see
+# robot_system/commands.py) before the robot is touched, so a bad command
+# stops the batch before anything runs, then the whole batch runs on one
+# lease and all of its output is written in one transaction.
+def commands_job(job, serial, command_texts, override_output, refresh):
+    results = []
 
-# robot_do(): this function executes all commands in the command table in order
-# with the condition of with anki_vector.Robot(args.serial) as robot:
-# if there are commands in the commands in the command table, all you have to
-# do to execute is redirect to /execute_commands/ and this function will be
-# called. Output is sent to a flash message.
-def robot_do(override_output=None):
-    robot_commands = Command.query.all()
     try:
-        args = anki_vector.util.parse_command_args()
-        with anki_vector.Robot(args.serial, enable_camera_feed=True) as robot:
+        plans = [compile_command(text) for text in command_texts]
+        job.set_progress(0, len(plans))
+
+        with connection_manager.lease(serial, enable_camera_feed=True,
+                                      priority=job.priority) as robot:
+            for plan in plans:
+                results.append(str(run_plan(robot, plan)))
+                job.set_progress(len(results))
 
-            for command in robot_commands:
-                command_string = str(command)
-                robot_output_string = str(eval(command_string))
-                db_output = Output(output=robot_output_string)
-                db.session.add(db_output)
-                db.session.commit()
+    # the commands that ran before the failure are saved with it, they have
+    # already changed the robot
+    except CommandError as e:
+        save_output(*completed_output(results),
+                    job.name + ' failed: ' + str(e))
+        raise JobError(str(e))
 
-            command_output = Output.query.all()
+    except anki_vector.exceptions.VectorNotFoundException:
+        status_poller.poll_now()
+        save_output(*completed_output(results),
+                    job.name + ' failed: Vector could not be found.')
+        raise JobError('vector_not_found')
+
+    except RobotBusy as e:
+        save_output(*completed_output(results),
+                    job.name + ' failed: ' + str(e))
+        raise JobError(str(e))
+
+    except anki_vector.exceptions.VectorControlTimeoutException:
+        save_output(*completed_output(results),
+                    job.name + ' failed: Vector is stuck.')
+        raise JobError('vector_stuck')
+
+    except Exception:
+        save_output(*completed_output(results), job.name + ' failed.')
+        raise
+
+    if override_output:
+        save_output(override_output)
+
+    else:
+        save_output(*completed_output(results))
+
+    if refresh:
+        status_poller.poll_now()
+
+    return results
+
+
+def completed_output(results):
+    return ['Command completed successfully! Output: ' + result
+            for result in results]
+
+
+# queue_dock_cube(): queues dock_cube_job() on the selected robot (or on
+# serial) and returns the Job straight away
+def queue_dock_cube(serial=None):
+    if serial is None:
+        serial = selected_serial()
 
-            if override_output:
-                flash(override_output, 'success')
+    return job_queue.submit('Dock Cube', dock_cube_job, serial,
+                            priority='high')
 
-            else:
-                for out in command_output:
-                    if out is None:
-                        pass
-                    else:
-                        out_string = 'Command completed successfully! Output: \
-                            ' + str(out)
-                        flash(out_string, 'success')
 
-    except NameError:
-        flash('Command not found!', 'warning')
+# dock_cube_job(): runs on a job worker. Drives off the charger, picks the
+# cube up and puts it back down.
+def dock_cube_job(job, serial):
+    try:
+        with connection_manager.lease(serial, priority=job.priority) as robot:
+            resolve(robot.behavior.drive_off_charger())
+            resolve(robot.world.connect_cube())
+            cube = robot.world.connected_light_cube
+
+            if cube:
+                resolve(robot.behavior.dock_with_cube(cube))
+                resolve(robot.behavior.set_lift_height(100.0))
+                time.sleep(5)
+                resolve(robot.behavior.set_lift_height(0, max_speed=10.0))
+                resolve(robot.world.disconnect_cube())
 
     except anki_vector.exceptions.VectorNotFoundException:
-        return 'vector_not_found'
+        status_poller.poll_now()
+        save_output(job.name + ' failed: Vector could not be found.')
+        raise JobError('vector_not_found')
+
+    except RobotBusy as e:
+        save_output(job.name + ' failed: ' + str(e))
+        raise JobError(str(e))
 
     except anki_vector.exceptions.VectorControlTimeoutException:
-        return 'vector_stuck'
+        save_output(job.name + ' failed: Vector is stuck.')
+        raise JobError('vector_stuck')
+
+    if cube:
+        save_output('Cube picked up!')
+    else:
+        save_output(job.name + ' failed: the cube could not be connected.')
+
+    status_poller.poll_now()
+
 
+broadcast_pool = ThreadPoolExecutor(
+    max_workers=app.config['FLEET_COMMAND_WORKERS'],
+    thread_name_prefix='fleet-command')
+
+
+# broadcast_commands(): like queue_commands(), but the batch in the command
+# table runs on every robot in serials at the same time, so a fleet wide
+# dock or say_text takes as long as the slowest robot instead of the sum of
+# them. Returns the Job straight away, its result has one entry per robot.
+def broadcast_commands(name, serials, override_output=None,
+                       priority='normal'):
+    command_texts = [str(command) for command in Command.query.all()]
     db.session.query(Command).delete()
-    db.session.query(Output).delete()
+    db.session.commit()
+    return job_queue.submit(name, broadcast_job, list(serials), command_texts,
+                            override_output, priority=priority)
+
+
+# run_on_robot(): runs compiled commands on one robot, on the broadcast pool.
+# A robot that fails is reported in its own entry instead of failing the
+# whole broadcast. It doesn't touch the database.
+def run_on_robot(serial, plans, priority='normal'):
+    started = time.time()
+    result = {'serial': serial, 'results': [], 'error': None}
+
+    try:
+        with connection_manager.lease(serial, enable_camera_feed=True,
+                                      priority=priority) as robot:
+            for plan in plans:
+                result['results'].append(str(run_plan(robot, plan)))
+
+    except CommandError as e:
+        result['error'] = str(e)
+
+    except anki_vector.exceptions.VectorNotFoundException:
+        result['error'] = 'Vector could not be found.'
+
+    except RobotBusy as e:
+        result['error'] = str(e)
+
+    except anki_vector.exceptions.VectorControlTimeoutException:
+        result['error'] = 'Vector is stuck.'
+
+    except connection_errors:
+        result['error'] = 'Lost the connection to Vector.'
+
+    except Exception:
+        app.logger.exception('Broadcast to %s failed', serial)
+        result['error'] = 'Something is not right, try again.'
+
+    result['seconds'] = time.time() - started
+    return result
+
+
+# broadcast_job(): runs on a job worker. The commands are compiled once, then
+# handed to one broadcast pool worker per robot. Progress counts robots, and
+# all of the output is written in one transaction once every robot is done.
+def broadcast_job(job, serials, command_texts, override_output):
+    try:
+        plans = [compile_command(text) for text in command_texts]
+
+    except CommandError as e:
+        save_output(job.name + ' failed: ' + str(e))
+        raise JobError(str(e))
+
+    job.set_progress(0, len(serials))
+    futures = [broadcast_pool.submit(run_on_robot, serial, plans,
+                                     job.priority)
+               for serial in serials]
+
+    results = []
+    for future in futures:
+        results.append(future.result())
+        job.set_progress(len(results))
+
+    messages = []
+    for result in results:
+        profile = sdk_config.get(result['serial'])
+        robot_name = profile.name if profile else result['serial']
+
+        if result['error']:
+            messages.append(robot_name + ' failed: ' + result['error'])
+
+        elif override_output:
+            messages.append(robot_name + ': ' + override_output)
+
+        else:
+            messages += [robot_name + ': Command completed successfully! '
+                         'Output: ' + output for output in result['results']]
+
+    save_output(*messages)
+
+    if any(result['error'] for result in results):
+        status_poller.poll_now()
+
+    return results
+
+
+def save_output(*messages):
+    db.session.add_all([Output(output=message) for message in messages])
     db.session.commit()
@@ -1,5 +1,6 @@
 #!/usr/bin/env python3
 
+from sqlalchemy import inspect, text
 from vectorcloud import db, login_manager
 from flask_login import UserMixin
 
@@ -60,8 +61,49 @@ class AppSupport(db.Model):
         return [self.id, self.hex_id, self.file_name]
 
 
+# runs an application unattended, on a cron expression ("0 3 * * *") or every
+# interval seconds, on serial (the default robot when None). misfire and
+# overlap are what to do about a run that was missed or that would overlap
+# the last one, see application_system/schedules.py
+class AppSchedule(db.Model):
+    id = db.Column(db.Integer, primary_key=True)
+    hex_id = db.Column(db.Text, index=True)
+    cron = db.Column(db.Text)
+    interval = db.Column(db.Integer)
+    serial = db.Column(db.Text)
+    misfire = db.Column(db.Text, default='run_once')
+    overlap = db.Column(db.Text, default='skip')
+    enabled = db.Column(db.Boolean, default=True)
+    next_run = db.Column(db.Float)
+    last_run = db.Column(db.Float)
+
+    def __repr__(self):
+        return str([self.id, self.hex_id, self.cron, self.interval,
+                    self.serial, self.misfire, self.overlap, self.enabled,
+                    self.next_run, self.last_run])
+
+
+# one run of an application, started by hand or by schedule_id. outcome is
+# success, failed, stopped, cancelled, busy (the robot wasn't free), skipped
+# (still running from last time) or missed.
+class AppRun(db.Model):
+    id = db.Column(db.Integer, primary_key=True)
+    hex_id = db.Column(db.Text, index=True)
+    schedule_id = db.Column(db.Integer)
+    started = db.Column(db.Float)
+    duration = db.Column(db.Float)
+    outcome = db.Column(db.Text)
+    returncode = db.Column(db.Integer)
+
+    def __repr__(self):
+        return str([self.id, self.hex_id, self.schedule_id, self.started,
+                    self.duration, self.outcome, self.returncode])
+
+
+# latest status of each robot in the fleet, one row per serial
 class Status(db.Model):
     id = db.Column(db.Integer, primary_key=True)
+    serial = db.Column(db.Text, index=True)
     version = db.Column(db.Text)
     battery_voltage = db.Column(db.Float)
     battery_level = db.Column(db.Integer)
@@ -69,16 +111,61 @@ class Status(db.Model):
     cube_battery_level = db.Column(db.Integer)
     cube_id = db.Column(db.Text)
     cube_battery_volts = db.Column(db.Float)
+    cube_connected = db.Column(db.Boolean)
     timestamp = db.Column(db.Float)
     ip = db.Column(db.Text)
     name = db.Column(db.Text)
 
     def __repr__(self):
-        return [self.id, self.battery_voltage, self.battery_level,
+        return [self.id, self.serial, self.battery_voltage, self.battery_level,
                 self.status_charging, self.cube_battery_level,
                 self.cube_id, self.cube_battery_volts, self.timestamp]
 
 
+# one row per status poll, kept for TELEMETRY_RAW_RETENTION seconds before
+# being rolled up into StatusRollup buckets
+class StatusHistory(db.Model):
+    id = db.Column(db.Integer, primary_key=True)
+    serial = db.Column(db.Text)
+    timestamp = db.Column(db.Float, index=True)
+    version = db.Column(db.Text)
+    battery_voltage = db.Column(db.Float)
+    battery_level = db.Column(db.Integer)
+    status_charging = db.Column(db.Boolean)
+    cube_battery_level = db.Column(db.Integer)
+    cube_battery_volts = db.Column(db.Float)
+
+    __table_args__ = (db.Index('ix_status_history_serial_timestamp',
+                               'serial', 'timestamp'),)
+
+    def __repr__(self):
+        return str([self.id, self.serial, self.timestamp, self.version,
+                    self.battery_voltage, self.battery_level,
+                    self.status_charging, self.cube_battery_level,
+                    self.cube_battery_volts])
+
+
+# min/max/avg of one StatusHistory column over one bucket of time
+class StatusRollup(db.Model):
+    id = db.Column(db.Integer, primary_key=True)
+    serial = db.Column(db.Text)
+    metric = db.Column(db.Text)
+    bucket_start = db.Column(db.Float)
+    bucket_seconds = db.Column(db.Integer)
+    count = db.Column(db.Integer)
+    minimum = db.Column(db.Float)
+    maximum = db.Column(db.Float)
+    average = db.Column(db.Float)
+
+    __table_args__ = (db.Index('ix_status_rollup_serial_metric_bucket',
+                               'serial', 'metric', 'bucket_start'),)
+
+    def __repr__(self):
+        return str([self.id, self.serial, self.metric, self.bucket_start,
+                    self.bucket_seconds, self.count, self.minimum,
+                    self.maximum, self.average])
+
+
 class Settings(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     greeting_message_enabled = db.Column(db.Boolean, default=True)
@@ -108,3 +195,29 @@ class ApplicationStore(db.Model):
         return [self.id, self.script_name, self.author,
                 self.website, self.description, self.icon,
                 self.installed, self.zip_file]
+
+
+# db.create_all() only creates tables that don't exist yet. This adds the
+# columns and indexes that have been added to existing tables since the
+# database was made, so an older site.db keeps working.
+def upgrade_database():
+    inspector = inspect(db.engine)
+
+    with db.engine.begin() as connection:
+        for table in db.metadata.sorted_tables:
+            columns = [column['name']
+                       for column in inspector.get_columns(table.name)]
+
+            for column in table.columns:
+                if column.name not in columns:
+                    column_type = column.type.compile(db.engine.dialect)
+                    statement = 'ALTER TABLE "%s" ADD COLUMN "%s" %s' % \
+                        (table.name, column.name, column_type)
+                    connection.execute(text(statement))
+
+            indexes = [index['name']
+                       for index in inspector.get_indexes(table.name)]
+
+            for index in table.indexes:
+                if index.name not in indexes:
+                    index.create(connection)
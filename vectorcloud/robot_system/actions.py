@@ -0,0 +1,107 @@
+#!/usr/bin/env python3
+
+import threading
+from collections import deque
+from concurrent.futures import TimeoutError
+from vectorcloud import app
+from vectorcloud.robot_system.connection import resolve
+
+
+# what submit() does with a new action when the queue is full: drop the oldest
+# queued action to make room, or drop the new one
+overflow_policies = ('drop_oldest', 'drop_newest')
+
+
+# ------------------------------------------------------------------------------
+# Action executor
+# ------------------------------------------------------------------------------
+
+# runs queued robot actions (animations, say_text...) one after the other on
+# its own thread. An action is a (function, argument) pair; the function is
+# called with the argument and, as the robot is an AsyncRobot, the future it
+# returns is waited on so the next action starts as soon as the robot has
+# finished this one. Every change to the queue bumps version and wakes
+# wait_for_change(), which is how pages get pushed the queue.
+class ActionExecutor:
+
+    def __init__(self, max_size=10, overflow='drop_oldest', action_timeout=60):
+        if overflow not in overflow_policies:
+            raise ValueError('Unknown action queue overflow policy: ' +
+                             overflow)
+
+        self.max_size = max_size
+        self.overflow = overflow
+        self.action_timeout = action_timeout
+        self.queue = deque()
+        self.running = None
+        self.version = 0
+        self.stopped = False
+        self.condition = threading.Condition()
+        self.thread = threading.Thread(target=self.run,
+                                       name='action-executor',
+                                       daemon=True)
+
+    def start(self):
+        self.thread.start()
+
+    def stop(self):
+        with self.condition:
+            self.stopped = True
+            self.queue.clear()
+            self.changed()
+
+    # the caller holds the condition
+    def changed(self):
+        self.version += 1
+        self.condition.notify_all()
+
+    # returns False if the action was dropped because the queue is full
+    def submit(self, action):
+        with self.condition:
+            if len(self.queue) >= self.max_size:
+                if self.overflow == 'drop_newest':
+                    return False
+                self.queue.popleft()
+
+            self.queue.append(action)
+            self.changed()
+            return True
+
+    # (version, running action or None, queued actions)
+    def snapshot(self):
+        with self.condition:
+            return self.version, self.running, list(self.queue)
+
+    # wait_for_change(): blocks until the queue is different from version (or
+    # timeout seconds pass) and returns the current snapshot()
+    def wait_for_change(self, version=None, timeout=None):
+        with self.condition:
+            self.condition.wait_for(lambda: self.version != version,
+                                    timeout)
+            return self.snapshot()
+
+    def run(self):
+        while True:
+            with self.condition:
+                self.condition.wait_for(lambda: self.queue or self.stopped)
+                if self.stopped:
+                    return
+
+                self.running = self.queue.popleft()
+                self.changed()
+
+            function, argument = self.running
+            try:
+                resolve(function(argument), self.action_timeout)
+
+            except TimeoutError:
+                app.logger.warning('Action %s did not finish in %d seconds',
+                                   function.__name__, self.action_timeout)
+
+            except Exception:
+                app.logger.exception('Action %s failed', function.__name__)
+
+            finally:
+                with self.condition:
+                    self.running = None
+                    self.changed()
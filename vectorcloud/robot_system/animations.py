@@ -0,0 +1,71 @@
+#!/usr/bin/env python3
+
+import os
+import re
+import json
+import tempfile
+import threading
+from vectorcloud import app
+
+
+# ------------------------------------------------------------------------------
+# Animation catalog
+# ------------------------------------------------------------------------------
+
+# the sorted animation names a robot knows, kept on disk per robot OS version
+# (Status.version) so the list is only asked for once per firmware rather
+# than every time the remote control page loads. Loaded catalogs are also
+# kept in memory, and are immutable tuples so threads can share them.
+class AnimationCatalog:
+
+    def __init__(self, folder):
+        self.folder = folder
+        self.catalogs = {}
+        self.lock = threading.Lock()
+
+    def cache_file(self, version):
+        safe_version = re.sub(r'[^A-Za-z0-9._-]', '_', version)
+        return os.path.join(self.folder, 'animations-%s.json' % safe_version)
+
+    # get(): the animation names of robot, which runs version. Without a
+    # version (the robot hasn't been polled yet) the list comes straight from
+    # the robot and isn't cached.
+    def get(self, robot, version=None):
+        if not version:
+            return tuple(sorted(robot.anim.anim_list))
+
+        with self.lock:
+            anim_names = self.catalogs.get(version)
+            if anim_names is not None:
+                return anim_names
+
+            try:
+                with open(self.cache_file(version)) as cache_file:
+                    anim_names = tuple(json.load(cache_file))
+
+            # not cached yet, or a damaged cache file
+            except (OSError, ValueError):
+                anim_names = tuple(sorted(robot.anim.anim_list))
+                self.save(version, anim_names)
+
+            self.catalogs[version] = anim_names
+            return anim_names
+
+    # written next to the final file and moved over it, so a reader never
+    # sees half a catalog
+    def save(self, version, anim_names):
+        os.makedirs(self.folder, exist_ok=True)
+        fd, temp_file = tempfile.mkstemp(dir=self.folder,
+                                         prefix='.animations.',
+                                         suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'w') as cache_file:
+                json.dump(list(anim_names), cache_file)
+            os.replace(temp_file, self.cache_file(version))
+
+        except BaseException:
+            os.remove(temp_file)
+            raise
+
+
+animation_catalog = AnimationCatalog(app.config['ANIMATION_CACHE_FOLDER'])
@@ -0,0 +1,190 @@
+#!/usr/bin/env python3
+
+import io
+import sys
+import time
+import threading
+from collections import deque
+
+try:
+    from PIL import Image, features
+except ImportError:
+    sys.exit("Cannot import from PIL: Do `pip3 install --user Pillow` to install")
+
+
+# the formats a camera stream can be encoded in and their mime types
+content_types = {'JPEG': 'image/jpeg',
+                 'WEBP': 'image/webp',
+                 'PNG': 'image/png'}
+
+
+# negotiate_format(): the stream format to send a client, given the mime
+# types its Accept header lists. WebP is only sent to browsers that name it
+# (a */* wildcard doesn't count) and when Pillow was built with it, everyone
+# else gets JPEG.
+def negotiate_format(image_format, accepted):
+    image_format = image_format.upper()
+
+    if image_format not in content_types:
+        raise ValueError('Unknown camera stream format: ' + image_format)
+
+    if image_format == 'WEBP' and (not features.check('webp') or
+                                   'image/webp' not in accepted):
+        return 'JPEG'
+
+    return image_format
+
+
+# ------------------------------------------------------------------------------
+# Camera stream
+# ------------------------------------------------------------------------------
+
+# encodes a robot's camera frames once and hands the same bytes to every
+# viewer. capture is called on the broadcaster's own thread, at most fps times
+# a second, and returns a PIL image. The SDK replaces camera.latest_image with
+# a new object for every frame it receives, so an image that is the same
+# object as last time is skipped without being encoded; new ones are encoded
+# once and published with an increasing frame id. Viewers call
+# wait_for_frame() with the last id they sent and sleep until the next frame,
+# so five viewers cost about the same as one. The encoder thread
+# starts with the first viewer and stops once nobody has asked for a frame
+# for idle_timeout seconds. Frames are resized by scale first, quality and
+# subsampling (e.g. '4:2:0') are passed to Pillow for the lossy formats.
+class FrameBroadcaster:
+
+    def __init__(self, capture, fps=30, idle_timeout=5, image_format='JPEG',
+                 scale=1.0, quality=70, subsampling='4:2:0'):
+        self.capture = capture
+        self.frame_interval = 1 / fps
+        self.idle_timeout = idle_timeout
+        self.image_format = image_format
+        self.scale = scale
+        self.quality = quality
+        self.subsampling = subsampling
+        self.content_type = content_types[image_format]
+        self.frame = None
+        self.frame_id = 0
+        self.last_image = None
+        self.last_read = 0
+        self.stopped = False
+        self.thread = None
+        self.condition = threading.Condition()
+
+    # wait_for_frame(): blocks until there is a frame newer than
+    # last_frame_id (or timeout seconds pass) and returns (frame_id, frame).
+    # frame is None if nothing has been encoded yet.
+    def wait_for_frame(self, last_frame_id=None, timeout=None):
+        with self.condition:
+            self.last_read = time.time()
+            self.start()
+
+            self.condition.wait_for(
+                lambda: self.stopped or (self.frame is not None and
+                                         self.frame_id != last_frame_id),
+                timeout)
+
+            return self.frame_id, self.frame
+
+    # the caller holds the condition
+    def start(self):
+        if self.thread is None and not self.stopped:
+            self.thread = threading.Thread(target=self.run,
+                                           name='camera-broadcaster',
+                                           daemon=True)
+            self.thread.start()
+
+    def stop(self):
+        with self.condition:
+            self.stopped = True
+            self.condition.notify_all()
+
+    def encode(self, image):
+        img_io = io.BytesIO()
+
+        if self.scale != 1.0:
+            width, height = image.size
+            image = image.resize((max(int(width * self.scale), 1),
+                                  max(int(height * self.scale), 1)),
+                                 Image.BILINEAR)
+
+        if self.image_format == 'JPEG':
+            image.save(img_io, 'JPEG', quality=self.quality,
+                       subsampling=self.subsampling)
+
+        elif self.image_format == 'WEBP':
+            image.save(img_io, 'WEBP', quality=self.quality)
+
+        else:
+            image.save(img_io, 'PNG')
+
+        return img_io.getvalue()
+
+    def run(self):
+        try:
+            while True:
+                with self.condition:
+                    idle = time.time() - self.last_read
+                    if self.stopped or idle > self.idle_timeout:
+                        self.thread = None
+                        return
+
+                started = time.time()
+                image = self.capture()
+
+                if image is not self.last_image:
+                    self.last_image = image
+                    frame = self.encode(image)
+
+                    with self.condition:
+                        self.frame = frame
+                        self.frame_id += 1
+                        self.condition.notify_all()
+
+                elapsed = time.time() - started
+                time.sleep(max(self.frame_interval - elapsed, 0))
+
+        # the next viewer starts a new thread, even if this one died
+        finally:
+            with self.condition:
+                if self.thread is threading.current_thread():
+                    self.thread = None
+
+
+# ------------------------------------------------------------------------------
+# Stream sessions
+# ------------------------------------------------------------------------------
+
+# one viewer's side of a camera stream. The stream generator reports how long
+# each frame took to write to the client; a slow client makes the write block,
+# so a window of writes averaging more than the frame interval means the
+# client can't keep up and the session steps down a level (smaller, lower
+# quality frames). Averaging under a quarter of it steps back up. Frames that
+# arrive while a write is blocked are never queued: the generator always asks
+# for the newest one next, so a slow client sees a lower frame rate instead
+# of growing lag.
+class StreamSession:
+
+    def __init__(self, level_count, frame_interval, window=10):
+        self.level_count = level_count
+        self.frame_interval = frame_interval
+        self.window = window
+        self.level = 0
+        self.writes = deque(maxlen=window)
+
+    def record_write(self, seconds):
+        self.writes.append(seconds)
+
+        # judge each level on a full window of its own frames
+        if len(self.writes) < self.window:
+            return
+
+        average = sum(self.writes) / self.window
+
+        if average > self.frame_interval and \
+                self.level < self.level_count - 1:
+            self.level += 1
+            self.writes.clear()
+
+        elif average < self.frame_interval / 4 and self.level > 0:
+            self.level -= 1
+            self.writes.clear()
@@ -0,0 +1,226 @@
+#!/usr/bin/env python3
+
+import ast
+import sys
+from functools import lru_cache
+from collections import namedtuple
+from vectorcloud.robot_system.connection import resolve
+
+try:
+    from anki_vector.util import degrees, radians, distance_mm,\
+        distance_inches, speed_mmps
+except ImportError:
+    sys.exit("Cannot import from anki_vector: Install per Anki instructions")
+
+
+# ------------------------------------------------------------------------------
+# Command pipeline
+# ------------------------------------------------------------------------------
+# Commands staged on the home page (e.g. robot.behavior.say_text('hi')) are
+# compiled once into a CommandPlan instead of being eval'd every time they run.
+# Only these shapes are accepted:
+#
+#    robot.<attribute>...                  reads an attribute
+#    robot.<attribute>...(<arguments>)     calls a method
+#
+# where every argument (positional or keyword) is a python literal, another
+# robot.<attribute> read, or one of the unit helpers below called with literal
+# arguments, e.g. robot.behavior.turn_in_place(degrees(90)). Only the methods
+# in callable_methods can be called, and only the attributes in
+# readable_attributes (and whatever they hold, e.g. robot.pose.position.x)
+# can be read, so a command can't reach the connection or disconnect the
+# robot. Attributes that start with an underscore are never allowed.
+
+# unit helpers commands may use, they are evaluated when the command compiles
+helpers = {'degrees': degrees,
+           'radians': radians,
+           'distance_mm': distance_mm,
+           'distance_inches': distance_inches,
+           'speed_mmps': speed_mmps}
+
+
+# methods commands may call, by the component they belong to (() is the robot
+# itself), as found in SDK 0.5.1
+callable_methods = {
+    (): frozenset(['get_battery_state', 'get_version_state',
+                   'get_network_state', 'say_text']),
+    ('anim',): frozenset(['play_animation', 'load_animation_list']),
+    ('behavior',): frozenset(['drive_off_charger', 'drive_on_charger',
+                              'drive_straight', 'turn_in_place',
+                              'go_to_pose', 'dock_with_cube',
+                              'set_head_angle', 'set_lift_height',
+                              'set_eye_color']),
+    ('faces',): frozenset(['request_enrolled_names']),
+    ('motors',): frozenset(['set_wheel_motors', 'set_head_motor',
+                            'set_lift_motor']),
+    ('screen',): frozenset(['set_screen_to_color',
+                            'set_screen_with_image_data']),
+    ('vision',): frozenset(['enable_custom_object_detection',
+                            'enable_face_detection',
+                            'enable_display_camera_feed_on_face',
+                            'disable_all_vision_modes']),
+    ('world',): frozenset(['connect_cube', 'disconnect_cube',
+                           'flash_cube_lights', 'get_object', 'get_face'])}
+
+# attributes commands may read, by the component they belong to
+readable_attributes = {
+    (): frozenset(['status', 'pose', 'pose_angle_rad', 'pose_pitch_rad',
+                   'head_angle_rad', 'lift_height_mm',
+                   'left_wheel_speed_mmps', 'right_wheel_speed_mmps',
+                   'accel', 'gyro', 'carrying_object_id',
+                   'head_tracking_object_id', 'localized_to_object_id',
+                   'last_image_time_stamp']),
+    ('anim',): frozenset(['anim_list']),
+    ('proximity',): frozenset(['last_sensor_reading',
+                               'last_valid_sensor_reading']),
+    ('touch',): frozenset(['last_sensor_reading']),
+    ('vision',): frozenset(['detect_faces', 'detect_custom_objects',
+                            'display_camera_feed_on_face']),
+    ('world',): frozenset(['connected_light_cube', 'light_cube', 'charger',
+                           'all_objects', 'visible_faces',
+                           'visible_custom_objects'])}
+
+
+class CommandError(Exception):
+    pass
+
+
+# path is a tuple of attribute names starting from robot, is_call says whether
+# the attribute is called, args is a tuple of Arguments and kwargs a tuple of
+# (name, Argument) pairs.
+CommandPlan = namedtuple('CommandPlan',
+                         ['text', 'path', 'is_call', 'args', 'kwargs'])
+
+# an argument is either a constant (path is None) or a robot attribute that is
+# read when the command runs
+Argument = namedtuple('Argument', ['path', 'value'])
+
+
+def robot_path(node, text):
+    names = []
+
+    while isinstance(node, ast.Attribute):
+        if node.attr.startswith('_'):
+            raise CommandError('Private attributes are not allowed: ' + text)
+        names.append(node.attr)
+        node = node.value
+
+    if not isinstance(node, ast.Name) or node.id != 'robot' or not names:
+        raise CommandError('Commands have to start with "robot.": ' + text)
+
+    return tuple(reversed(names))
+
+
+# is_readable(): whether path starts with one of the readable_attributes
+def is_readable(path):
+    return any(path[index] in readable_attributes.get(path[:index], ())
+               for index in range(min(len(path), 2)))
+
+
+def read_path(node, text):
+    path = robot_path(node, text)
+    if not is_readable(path):
+        raise CommandError('Attribute not allowed: ' + text)
+    return path
+
+
+def call_path(node, text):
+    path = robot_path(node, text)
+    if path[-1] not in callable_methods.get(path[:-1], ()):
+        raise CommandError('Method not allowed: ' + text)
+    return path
+
+
+def literal(node, text):
+    try:
+        return ast.literal_eval(node)
+
+    # TypeError for literals python can't build, e.g. {[]: 1}
+    except (ValueError, TypeError):
+        raise CommandError('Arguments have to be literals: ' + text)
+
+
+def compile_argument(node, text):
+    if isinstance(node, ast.Attribute):
+        return Argument(read_path(node, text), None)
+
+    if isinstance(node, ast.Call) and isinstance(node.func, ast.Name) and \
+            node.func.id in helpers:
+        if any(keyword.arg is None for keyword in node.keywords):
+            raise CommandError('** arguments are not allowed: ' + text)
+
+        args = [literal(arg, text) for arg in node.args]
+        kwargs = {keyword.arg: literal(keyword.value, text)
+                  for keyword in node.keywords}
+        try:
+            return Argument(None, helpers[node.func.id](*args, **kwargs))
+
+        except (ValueError, TypeError):
+            raise CommandError('Bad arguments to %s(): %s'
+                               % (node.func.id, text))
+
+    if isinstance(node, ast.Starred):
+        raise CommandError('* arguments are not allowed: ' + text)
+
+    return Argument(None, literal(node, text))
+
+
+# compile_command(): parses one command into a CommandPlan, or raises
+# CommandError if it isn't one of the allowed shapes. Plans are cached by
+# command text so a command staged over and over is only parsed once.
+@lru_cache(maxsize=256)
+def compile_command(text):
+    text = text.strip()
+
+    try:
+        node = ast.parse(text, mode='eval').body
+
+    except SyntaxError:
+        raise CommandError('Could not understand command: ' + text)
+
+    if not isinstance(node, ast.Call):
+        return CommandPlan(text, read_path(node, text), False, (), ())
+
+    if any(keyword.arg is None for keyword in node.keywords):
+        raise CommandError('** arguments are not allowed: ' + text)
+
+    args = tuple(compile_argument(arg, text) for arg in node.args)
+    kwargs = tuple((keyword.arg, compile_argument(keyword.value, text))
+                   for keyword in node.keywords)
+
+    return CommandPlan(text, call_path(node.func, text), True, args, kwargs)
+
+
+def lookup(robot, path, text):
+    target = robot
+
+    try:
+        for name in path:
+            target = getattr(target, name)
+
+    except AttributeError:
+        raise CommandError('Command not found: ' + text)
+
+    return target
+
+
+def argument_value(robot, argument, text):
+    if argument.path is None:
+        return argument.value
+    return lookup(robot, argument.path, text)
+
+
+# run_plan(): runs one compiled command against a robot from the connection
+# manager and returns its result (waiting for it if the SDK returned a future)
+def run_plan(robot, plan):
+    target = lookup(robot, plan.path, plan.text)
+
+    if not plan.is_call:
+        return resolve(target)
+
+    args = [argument_value(robot, arg, plan.text) for arg in plan.args]
+    kwargs = {name: argument_value(robot, arg, plan.text)
+              for name, arg in plan.kwargs}
+
+    return resolve(target(*args, **kwargs))
+
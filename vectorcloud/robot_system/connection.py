@@ -0,0 +1,505 @@
+#!/usr/bin/env python3
+
+import sys
+import time
+import atexit
+import threading
+from concurrent.futures import Future
+from contextlib import contextmanager, nullcontext
+from grpc._channel import _Rendezvous
+from vectorcloud import app
+from vectorcloud.robot_system.sdk_config import sdk_config
+from vectorcloud.robot_system.scheduler import robot_scheduler, web_owner
+
+try:
+    import anki_vector
+except ImportError:
+    sys.exit("Cannot import from anki_vector: Install per Anki instructions")
+
+
+# exceptions that mean the connection itself is gone and has to be rebuilt
+connection_errors = (_Rendezvous,
+                     anki_vector.exceptions.VectorConnectionException)
+
+# exceptions that count as a failed attempt to reach the robot for its
+# circuit breaker: a broken connection, or a robot that can't be found
+breaker_errors = connection_errors + \
+    (anki_vector.exceptions.VectorNotFoundException,)
+
+# exceptions that mean behavior control couldn't be given back: the
+# connection is gone, or the robot didn't answer within the SDK's timeout.
+# Either way the connection is dropped, which gives control back too.
+release_errors = connection_errors + \
+    (anki_vector.exceptions.VectorControlTimeoutException,)
+
+
+# resolve(): the robots held by the connection manager are AsyncRobots, so
+# most SDK calls hand back a future. This waits for the future and returns its
+# result, anything that isn't a future is passed straight through.
+def resolve(result, timeout=None):
+    if isinstance(result, Future):
+        return result.result(timeout)
+    return result
+
+
+# the serial used when a caller doesn't ask for a specific robot: the one given
+# on the command line or in ANKI_ROBOT_SERIAL, otherwise the first robot in
+# sdk_config.ini.
+def default_serial():
+    args = anki_vector.util.parse_command_args()
+    if args.serial:
+        return args.serial
+
+    profile = sdk_config.default_profile()
+    if profile is not None:
+        return profile.serial
+    return None
+
+
+# the animation list isn't loaded on connect, the remote control page reads it
+# from the animation catalog and the SDK loads it on the first play_animation
+def create_robot(serial, enable_camera_feed=False):
+    robot = anki_vector.AsyncRobot(serial,
+                                   requires_behavior_control=False,
+                                   cache_animation_list=False,
+                                   enable_camera_feed=enable_camera_feed)
+    robot.connect()
+    return robot
+
+
+# raised straight away, without trying to connect, while a robot's circuit
+# breaker is open. It is a VectorNotFoundException so everything that already
+# handles an unreachable robot handles this too.
+class RobotUnavailable(anki_vector.exceptions.VectorNotFoundException):
+
+    def __init__(self, serial, retry_at):
+        self.serial = serial
+        self.retry_at = retry_at
+        super().__init__('Vector %s is unreachable, next retry in %d seconds'
+                         % (serial, max(retry_at - time.time(), 0)))
+
+
+# ------------------------------------------------------------------------------
+# Circuit breaker
+# ------------------------------------------------------------------------------
+
+# counts consecutive connection failures for one robot. After threshold of
+# them the breaker opens: callers are turned away at once instead of each
+# waiting out the connect timeout, and the manager probes the robot in the
+# background, doubling the wait between probes from base_backoff up to
+# max_backoff, until it answers again.
+class CircuitBreaker:
+
+    def __init__(self, threshold, base_backoff, max_backoff):
+        self.threshold = threshold
+        self.base_backoff = base_backoff
+        self.max_backoff = max_backoff
+        self.failures = 0
+        self.backoff = base_backoff
+        self.retry_at = None
+
+    def is_open(self):
+        return self.retry_at is not None
+
+    # returns True if this failure is the one that opened the breaker
+    def record_failure(self):
+        self.failures += 1
+
+        if self.is_open() or self.failures < self.threshold:
+            return False
+
+        self.backoff = self.base_backoff
+        self.retry_at = time.time() + self.backoff
+        return True
+
+    def back_off(self):
+        self.backoff = min(self.backoff * 2, self.max_backoff)
+        self.retry_at = time.time() + self.backoff
+
+    def reset(self):
+        self.failures = 0
+        self.backoff = self.base_backoff
+        self.retry_at = None
+
+
+# ------------------------------------------------------------------------------
+# Robot connections
+# ------------------------------------------------------------------------------
+
+# one warm connection to one robot. The lock is held for the length of a lease
+# with behavior control so only one caller drives the robot at a time; read
+# only leases hold it just while connecting.
+class RobotConnection:
+
+    def __init__(self, serial, breaker):
+        self.serial = serial
+        self.breaker = breaker
+        self.probing = False
+        self.robot = None
+        self.camera_enabled = False
+        self.has_control = False
+        self.leases = 0
+        self.holds = 0
+        self.claimed_holds = 0
+        self.last_used = time.time()
+        self.lock = threading.RLock()
+
+    # connects if there isn't a live robot yet. Asking for the camera feed on a
+    # connection that was opened without it reconnects once with it enabled,
+    # after that the camera stays on for the life of the connection.
+    def connect(self, enable_camera_feed=False):
+        if self.robot is not None:
+            if self.camera_enabled or not enable_camera_feed:
+                return self.robot
+            self.disconnect()
+
+        self.install(create_robot(self.serial, enable_camera_feed),
+                     enable_camera_feed)
+        return self.robot
+
+    def install(self, robot, camera_enabled):
+        self.robot = robot
+        self.camera_enabled = camera_enabled
+        self.has_control = False
+
+    def disconnect(self):
+        robot = self.robot
+        self.robot = None
+        self.camera_enabled = False
+        self.has_control = False
+
+        if robot is not None:
+            # the connection may already be broken, there is nothing useful
+            # to do with an error while tearing it down
+            try:
+                robot.disconnect()
+            except Exception:
+                pass
+
+    def request_control(self):
+        if not self.has_control:
+            resolve(self.robot.conn.request_control())
+            self.has_control = True
+
+    def release_control(self):
+        if self.has_control:
+            resolve(self.robot.conn.release_control())
+            self.has_control = False
+
+    def touch(self):
+        self.last_used = time.time()
+
+
+# ------------------------------------------------------------------------------
+# Connection manager
+# ------------------------------------------------------------------------------
+
+# keeps one warm connection per serial for the whole process and hands out
+# leases on it. Connections that break are dropped and rebuilt on the next
+# lease, and a reaper thread gives behavior control back to the robot once a
+# connection has been idle for control_idle_timeout seconds (and disconnects
+# after disconnect_idle_timeout seconds, if that is set). Each connection has a
+# CircuitBreaker, functions in recovered are called with the serial whenever a
+# background probe finds a robot that was unreachable. Behavior control is
+# claimed from the robot scheduler (waiting up to claim_timeout seconds)
+# before it is taken, so the web app never fights an application for it.
+class ConnectionManager:
+
+    def __init__(self, control_idle_timeout=10, disconnect_idle_timeout=None,
+                 reap_interval=2, breaker_threshold=1, breaker_backoff=5,
+                 breaker_max_backoff=300, claim_timeout=30):
+        self.control_idle_timeout = control_idle_timeout
+        self.disconnect_idle_timeout = disconnect_idle_timeout
+        self.reap_interval = reap_interval
+        self.breaker_threshold = breaker_threshold
+        self.breaker_backoff = breaker_backoff
+        self.breaker_max_backoff = breaker_max_backoff
+        self.claim_timeout = claim_timeout
+        self.connections = {}
+        self.recovered = []
+        self.lock = threading.Lock()
+        self.reaper = None
+        self.stopped = threading.Event()
+
+    def get_connection(self, serial=None):
+        if serial is None:
+            serial = default_serial()
+
+        with self.lock:
+            connection = self.connections.get(serial)
+            if connection is None:
+                breaker = CircuitBreaker(self.breaker_threshold,
+                                         self.breaker_backoff,
+                                         self.breaker_max_backoff)
+                connection = RobotConnection(serial, breaker)
+                self.connections[serial] = connection
+
+            if self.reaper is None:
+                self.reaper = threading.Thread(target=self.reap,
+                                               name='robot-connection-reaper',
+                                               daemon=True)
+                self.reaper.start()
+
+        return connection
+
+    # claim(): read only leases don't need the robot to themselves, so they
+    # claim nothing
+    def claim(self, connection, behavior_control, priority):
+        if not behavior_control:
+            return nullcontext()
+
+        return robot_scheduler.claim(connection.serial, web_owner, priority,
+                                     self.claim_timeout)
+
+    # lease(): use as "with connection_manager.lease() as robot:". Connects
+    # (or reconnects) if needed, takes behavior control when asked to, and
+    # drops the connection if it turns out to be broken so the next lease
+    # starts fresh. Raises RobotBusy if an application has the robot for
+    # longer than claim_timeout. Read only leases (status polls) run
+    # alongside whoever is driving the robot.
+    @contextmanager
+    def lease(self, serial=None, behavior_control=True,
+              enable_camera_feed=False, priority='normal'):
+        connection = self.get_connection(serial)
+        self.check_breaker(connection)
+        robot = None
+
+        with self.claim(connection, behavior_control, priority), \
+                self.lease_lock(connection, behavior_control):
+            with self.lock:
+                connection.leases += 1
+
+            try:
+                robot = self.lease_robot(connection, behavior_control,
+                                         enable_camera_feed)
+                yield robot
+
+            # turned away by another robot's breaker, not a failure of ours
+            except RobotUnavailable:
+                raise
+
+            except breaker_errors:
+                with connection.lock:
+                    # a read only lease may find the robot already replaced
+                    if robot is None or connection.robot is robot:
+                        connection.disconnect()
+                self.record_failure(connection)
+                raise
+
+            except anki_vector.exceptions.VectorControlTimeoutException:
+                connection.has_control = False
+                raise
+
+            else:
+                connection.breaker.reset()
+
+            finally:
+                with self.lock:
+                    connection.leases -= 1
+                connection.touch()
+
+    # lease_lock(): a lease with behavior control holds the connection's lock
+    # until it ends. A read only lease doesn't, see lease_robot().
+    def lease_lock(self, connection, behavior_control):
+        if behavior_control:
+            return connection.lock
+        return nullcontext()
+
+    # lease_robot(): the robot for a lease. A read only lease uses the live
+    # robot as it is, whoever is driving it, and only takes the lock when it
+    # has to connect.
+    def lease_robot(self, connection, behavior_control, enable_camera_feed):
+        robot = connection.robot
+        if not behavior_control and robot is not None and \
+                (connection.camera_enabled or not enable_camera_feed):
+            return robot
+
+        with connection.lock:
+            self.open(connection, behavior_control, enable_camera_feed)
+            return connection.robot
+
+    # hold(): for callers that keep the robot across requests (the remote
+    # control page). A held connection is never released by the reaper until
+    # release() is called for it, and a hold with behavior control keeps its
+    # claim on the robot until then too.
+    def hold(self, serial=None, behavior_control=True,
+             enable_camera_feed=False, priority='high'):
+        connection = self.get_connection(serial)
+        self.check_breaker(connection)
+
+        if behavior_control:
+            robot_scheduler.acquire(connection.serial, web_owner, priority,
+                                    self.claim_timeout)
+
+        try:
+            with connection.lock:
+                try:
+                    self.open(connection, behavior_control,
+                              enable_camera_feed)
+
+                except breaker_errors:
+                    connection.disconnect()
+                    self.record_failure(connection)
+                    raise
+
+                connection.breaker.reset()
+                connection.holds += 1
+                if behavior_control:
+                    connection.claimed_holds += 1
+                connection.touch()
+                return connection.robot
+
+        except BaseException:
+            if behavior_control:
+                robot_scheduler.release(connection.serial, web_owner)
+            raise
+
+    def release(self, serial=None):
+        connection = self.get_connection(serial)
+
+        with connection.lock:
+            if connection.holds > 0:
+                connection.holds -= 1
+            if connection.claimed_holds > 0:
+                connection.claimed_holds -= 1
+                robot_scheduler.release(connection.serial, web_owner)
+            connection.touch()
+
+    # release_control(): gives behavior control back now instead of when the
+    # reaper gets to it, e.g. because an application is about to take it
+    def release_control(self, serial=None):
+        connection = self.get_connection(serial)
+
+        with connection.lock:
+            try:
+                connection.release_control()
+
+            except release_errors:
+                connection.disconnect()
+
+    # drops the connection and closes its breaker so the next lease
+    # reconnects straight away, e.g. after the robot's ip has changed in
+    # sdk_config.ini
+    def disconnect(self, serial=None):
+        connection = self.get_connection(serial)
+
+        with connection.lock:
+            connection.disconnect()
+            connection.breaker.reset()
+
+    def check_breaker(self, connection):
+        breaker = connection.breaker
+        if breaker.is_open():
+            raise RobotUnavailable(connection.serial, breaker.retry_at)
+
+    def record_failure(self, connection):
+        if connection.breaker.record_failure() and not connection.probing:
+            connection.probing = True
+            threading.Thread(target=self.probe, args=(connection,),
+                             name='robot-probe', daemon=True).start()
+
+    # probe(): runs on its own thread while a breaker is open. The robot is
+    # connected to without holding the connection's lock, so callers keep
+    # being turned away at once while a probe waits out the connect timeout.
+    def probe(self, connection):
+        breaker = connection.breaker
+
+        try:
+            while True:
+                retry_at = breaker.retry_at
+                if retry_at is None:
+                    break
+
+                if self.stopped.wait(max(retry_at - time.time(), 0)):
+                    return
+
+                # any error backs off, a probe that died would leave the
+                # breaker open for good
+                try:
+                    robot = create_robot(connection.serial)
+
+                except Exception:
+                    breaker.back_off()
+                    continue
+
+                with connection.lock:
+                    if connection.robot is None:
+                        connection.install(robot, False)
+                    else:
+                        robot.disconnect()
+                    breaker.reset()
+
+        finally:
+            connection.probing = False
+
+        for callback in self.recovered:
+            callback(connection.serial)
+
+    # connects, retrying once if the first attempt hits a dead channel (the
+    # robot's gRPC server drops idle channels now and then).
+    def open(self, connection, behavior_control, enable_camera_feed):
+        try:
+            connection.connect(enable_camera_feed)
+
+        except _Rendezvous:
+            connection.disconnect()
+            connection.connect(enable_camera_feed)
+
+        if behavior_control:
+            connection.request_control()
+
+    def reap(self):
+        while not self.stopped.wait(self.reap_interval):
+            self.release_idle()
+
+    def release_idle(self):
+        now = time.time()
+
+        for connection in list(self.connections.values()):
+            # a connection that is leased right now is not idle
+            if not connection.lock.acquire(blocking=False):
+                continue
+
+            try:
+                if connection.robot is None or connection.holds > 0 or \
+                        connection.leases > 0:
+                    continue
+
+                idle = now - connection.last_used
+
+                if self.disconnect_idle_timeout is not None and \
+                        idle > self.disconnect_idle_timeout:
+                    connection.disconnect()
+
+                elif idle > self.control_idle_timeout:
+                    connection.release_control()
+
+            except release_errors:
+                connection.disconnect()
+
+            # one robot must not stop the reaper for all of them
+            except Exception:
+                app.logger.exception('Releasing idle connection to %s failed',
+                                     connection.serial)
+                connection.disconnect()
+
+            finally:
+                connection.lock.release()
+
+    def disconnect_all(self):
+        self.stopped.set()
+
+        for connection in list(self.connections.values()):
+            with connection.lock:
+                connection.disconnect()
+
+
+connection_manager = ConnectionManager(
+    control_idle_timeout=app.config['ROBOT_CONTROL_IDLE_TIMEOUT'],
+    disconnect_idle_timeout=app.config['ROBOT_DISCONNECT_IDLE_TIMEOUT'],
+    breaker_threshold=app.config['ROBOT_BREAKER_THRESHOLD'],
+    breaker_backoff=app.config['ROBOT_BREAKER_BACKOFF'],
+    breaker_max_backoff=app.config['ROBOT_BREAKER_MAX_BACKOFF'],
+    claim_timeout=app.config['ROBOT_CLAIM_TIMEOUT'])
+
+atexit.register(connection_manager.disconnect_all)
@@ -0,0 +1,140 @@
+#!/usr/bin/env python3
+
+import time
+import queue
+import secrets
+import itertools
+import threading
+from collections import OrderedDict
+from vectorcloud import app, db
+from vectorcloud.robot_system.scheduler import priorities
+
+
+# raised by a job's target to fail it with a message meant for the user
+class JobError(Exception):
+    pass
+
+
+# one unit of robot work. target is called as target(job, *args) on a worker
+# thread inside an app context, its return value becomes job.result. Targets
+# pass job.priority on when they claim a robot.
+class Job:
+
+    def __init__(self, name, target, args, priority='normal'):
+        self.id = secrets.token_hex(8)
+        self.name = name
+        self.target = target
+        self.args = args
+        self.priority = priority
+        self.state = 'queued'
+        self.done = 0
+        self.total = None
+        self.result = None
+        self.error = None
+        self.created = time.time()
+        self.started = None
+        self.finished = None
+
+    def set_progress(self, done, total=None):
+        self.done = done
+        if total is not None:
+            self.total = total
+
+    def is_active(self):
+        return self.state in ('queued', 'running')
+
+    def to_dict(self):
+        return {'id': self.id,
+                'name': self.name,
+                'priority': self.priority,
+                'state': self.state,
+                'done': self.done,
+                'total': self.total,
+                'result': self.result,
+                'error': self.error,
+                'created': self.created,
+                'started': self.started,
+                'finished': self.finished}
+
+
+# ------------------------------------------------------------------------------
+# Job queue
+# ------------------------------------------------------------------------------
+
+# routes submit() work and get a Job back straight away, a small pool of worker
+# threads runs the jobs by priority (see robot_system/scheduler.py), in the
+# order they were submitted within a priority. The last history finished jobs
+# are kept so their results can still be fetched.
+class JobQueue:
+
+    def __init__(self, workers=1, history=50):
+        self.workers = workers
+        self.history = history
+        self.queue = queue.PriorityQueue()
+        self.sequence = itertools.count()
+        self.jobs = OrderedDict()
+        self.lock = threading.Lock()
+        self.threads = []
+
+    def submit(self, name, target, *args, priority='normal'):
+        job = Job(name, target, args, priority)
+
+        with self.lock:
+            self.jobs[job.id] = job
+            self.prune()
+
+            # workers are started on first use rather than at import so the
+            # reloader's watcher process never runs any
+            while len(self.threads) < self.workers:
+                thread = threading.Thread(target=self.work,
+                                          name='job-worker',
+                                          daemon=True)
+                thread.start()
+                self.threads.append(thread)
+
+        self.queue.put((priorities[priority], next(self.sequence), job))
+        return job
+
+    def prune(self):
+        finished = [job_id for job_id, job in self.jobs.items()
+                    if not job.is_active()]
+
+        for job_id in finished[:max(len(finished) - self.history, 0)]:
+            del self.jobs[job_id]
+
+    def get(self, job_id):
+        with self.lock:
+            return self.jobs.get(job_id)
+
+    def all(self):
+        with self.lock:
+            return list(self.jobs.values())
+
+    def work(self):
+        while True:
+            _, _, job = self.queue.get()
+            job.state = 'running'
+            job.started = time.time()
+
+            with app.app_context():
+                try:
+                    job.result = job.target(job, *job.args)
+                    job.state = 'done'
+
+                except JobError as e:
+                    job.error = str(e)
+                    job.state = 'failed'
+
+                except Exception:
+                    app.logger.exception('Job %s failed', job.name)
+                    job.error = 'Something is not right, try again.'
+                    job.state = 'failed'
+
+                finally:
+                    db.session.remove()
+
+            job.finished = time.time()
+
+
+job_queue = JobQueue(workers=app.config['JOB_WORKERS'],
+                     history=app.config['JOB_HISTORY'])
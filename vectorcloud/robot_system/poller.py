@@ -0,0 +1,63 @@
+#!/usr/bin/env python3
+
+import time
+import threading
+from vectorcloud import app, db
+
+
+# runs refresh() on its own thread every interval seconds so routes only ever
+# read the result of the last poll. refresh() is called inside an app context
+# and should return a dict of error page names by robot serial, for the robots
+# that couldn't be polled.
+class StatusPoller:
+
+    def __init__(self, refresh, interval):
+        self.refresh = refresh
+        self.interval = interval
+        self.errors = {}
+        self.last_poll = None
+        self.thread = None
+        self.lock = threading.Lock()
+        self.wake = threading.Event()
+
+    # the thread is started on first use rather than at import so the
+    # reloader's watcher process never talks to the robot.
+    def start(self):
+        with self.lock:
+            if self.thread is None:
+                self.thread = threading.Thread(target=self.run,
+                                               name='status-poller',
+                                               daemon=True)
+                self.thread.start()
+
+    # asks for a refresh as soon as possible without waiting for it.
+    # clear_error=True forgets the last error of serial (or of every robot)
+    # until that refresh reports back, for when the user has just fixed
+    # whatever caused it.
+    def poll_now(self, clear_error=False, serial=None):
+        if clear_error:
+            if serial is None:
+                self.errors = {}
+            else:
+                self.errors.pop(serial, None)
+        self.start()
+        self.wake.set()
+
+    def poll(self):
+        with app.app_context():
+            try:
+                self.errors = self.refresh()
+
+            except Exception:
+                app.logger.exception('Status refresh failed')
+
+            finally:
+                db.session.remove()
+
+        self.last_poll = time.time()
+
+    def run(self):
+        while True:
+            self.poll()
+            self.wake.wait(self.interval)
+            self.wake.clear()
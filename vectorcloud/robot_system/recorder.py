@@ -0,0 +1,172 @@
+#!/usr/bin/env python3
+
+import os
+import mmap
+import time
+import struct
+import threading
+
+
+# every frame in a segment is stored as this header (timestamp, length)
+# followed by the encoded frame
+record_header = struct.Struct('<dI')
+
+
+# ------------------------------------------------------------------------------
+# Segments
+# ------------------------------------------------------------------------------
+
+# one fixed size, memory mapped file of the ring buffer. The file is created at
+# full size up front, so recording never grows anything on disk. generation
+# goes up every time the segment is reused, which is how a reader notices that
+# the frames it was reading have been overwritten.
+class Segment:
+
+    def __init__(self, path, size):
+        fd = os.open(path, os.O_RDWR | os.O_CREAT)
+        try:
+            os.ftruncate(fd, size)
+            self.map = mmap.mmap(fd, size)
+        finally:
+            os.close(fd)
+
+        self.used = 0
+        self.start = None
+        self.end = None
+        self.generation = 0
+
+    def reset(self):
+        self.used = 0
+        self.start = None
+        self.end = None
+        self.generation += 1
+
+    # returns False if the frame doesn't fit in what is left of the segment
+    def append(self, timestamp, frame):
+        offset = self.used + record_header.size
+        if offset + len(frame) > len(self.map):
+            return False
+
+        record_header.pack_into(self.map, self.used, timestamp, len(frame))
+        self.map[offset:offset + len(frame)] = frame
+        self.used = offset + len(frame)
+
+        if self.start is None:
+            self.start = timestamp
+        self.end = timestamp
+        return True
+
+    # (timestamp, frame) of the record at offset and the offset of the next
+    def read(self, offset):
+        timestamp, length = record_header.unpack_from(self.map, offset)
+        offset += record_header.size
+        return timestamp, bytes(self.map[offset:offset + length]), \
+            offset + length
+
+
+# ------------------------------------------------------------------------------
+# Camera recorder
+# ------------------------------------------------------------------------------
+
+# keeps the last segment_count * segment_seconds seconds of one robot's camera
+# in segment_count segment files of segment_bytes each under folder, reusing
+# the oldest segment once they are all full. A segment is closed after
+# segment_seconds, or earlier if a frame doesn't fit in it. Frames are read
+# from a FrameBroadcaster, which keeps that stream's encoder running for as
+# long as the recorder is attached to it.
+class CameraRecorder:
+
+    def __init__(self, folder, segment_count=10,
+                 segment_bytes=16 * 1024 * 1024, segment_seconds=60):
+        os.makedirs(folder, exist_ok=True)
+        self.segment_seconds = segment_seconds
+        self.segments = [Segment(os.path.join(folder, 'segment-%d' % i),
+                                 segment_bytes)
+                         for i in range(segment_count)]
+        self.current = 0
+        self.camera_stream = None
+        self.thread = None
+        self.lock = threading.Lock()
+
+    def write(self, timestamp, frame):
+        with self.lock:
+            segment = self.segments[self.current]
+
+            if segment.start is not None and \
+                    timestamp - segment.start >= self.segment_seconds:
+                segment = self.next_segment()
+
+            # a frame that doesn't fit in an empty segment is dropped
+            if not segment.append(timestamp, frame) and segment.used:
+                self.next_segment().append(timestamp, frame)
+
+    # the caller holds the lock
+    def next_segment(self):
+        self.current = (self.current + 1) % len(self.segments)
+        segment = self.segments[self.current]
+        segment.reset()
+        return segment
+
+    # attach(): starts recording from camera_stream, or switches to it if the
+    # recorder was already attached to another one (e.g. a new /control
+    # session). attach(None) stops recording.
+    def attach(self, camera_stream):
+        with self.lock:
+            self.camera_stream = camera_stream
+
+            if camera_stream is not None and self.thread is None:
+                self.thread = threading.Thread(target=self.run,
+                                               name='camera-recorder',
+                                               daemon=True)
+                self.thread.start()
+
+    def run(self):
+        camera_stream = None
+        frame_id = None
+
+        while True:
+            with self.lock:
+                if self.camera_stream is None:
+                    self.thread = None
+                    return
+
+                if self.camera_stream is not camera_stream:
+                    camera_stream = self.camera_stream
+                    frame_id = None
+
+            new_frame_id, frame = camera_stream.wait_for_frame(frame_id,
+                                                               timeout=1)
+            if frame is not None and new_frame_id != frame_id:
+                frame_id = new_frame_id
+                self.write(time.time(), frame)
+
+            elif camera_stream.stopped:
+                time.sleep(.1)
+
+    # clip(): yields the recorded frames between start and end (unix
+    # timestamps) oldest first, one at a time straight out of the segments,
+    # so exporting a long clip never holds more than one frame in memory.
+    # Reading stops early if recording catches up and overwrites the clip.
+    def clip(self, start, end):
+        with self.lock:
+            segments = [(segment.start, segment.generation, segment)
+                        for segment in self.segments
+                        if segment.start is not None and
+                        segment.start <= end and segment.end >= start]
+        segments.sort(key=lambda item: item[0])
+
+        for _, generation, segment in segments:
+            offset = 0
+
+            while True:
+                with self.lock:
+                    if segment.generation != generation:
+                        return
+                    if offset >= segment.used:
+                        break
+                    timestamp, frame, offset = segment.read(offset)
+
+                if timestamp > end:
+                    return
+                if timestamp >= start:
+                    yield frame
@@ -0,0 +1,130 @@
+#!/usr/bin/env python3
+
+import sys
+import heapq
+import itertools
+import threading
+from contextlib import contextmanager
+
+try:
+    import anki_vector
+except ImportError:
+    sys.exit("Cannot import from anki_vector: Install per Anki instructions")
+
+
+# claim priorities, lower goes first
+priorities = {'high': 0, 'normal': 1, 'low': 2}
+
+# the owner of every claim made by the web app itself: its jobs, leases and
+# the remote control session all drive the robot over the same connection, so
+# they can share the robot with each other but not with an application
+web_owner = 'vectorcloud'
+
+
+# raised when a claim times out because someone else is driving the robot. It
+# is a VectorControlTimeoutException so everything that already handles a
+# robot that won't give up control handles this too.
+class RobotBusy(anki_vector.exceptions.VectorControlTimeoutException):
+
+    def __init__(self, serial, owner):
+        self.serial = serial
+        self.owner = owner
+        super().__init__('Vector %s is busy (%s)' % (serial, owner))
+
+
+# who has one robot right now, how many claims they hold on it and who is
+# waiting for it, as a heap of (priority, sequence, owner)
+class RobotSlot:
+
+    def __init__(self):
+        self.owner = None
+        self.count = 0
+        self.waiters = []
+
+
+# ------------------------------------------------------------------------------
+# Robot scheduler
+# ------------------------------------------------------------------------------
+
+# hands out behavior control of each robot to one owner at a time. Anything
+# that needs behavior control claims the robot first; waiting claims are
+# granted by priority, then in the order they were made. Claims by the owner
+# that already has the robot are granted straight away (so a claim never
+# waits on itself). Read only work (status polls) doesn't claim anything and
+# runs alongside whoever has the robot.
+class RobotScheduler:
+
+    def __init__(self):
+        self.slots = {}
+        self.sequence = itertools.count()
+        self.condition = threading.Condition()
+
+    # acquire(): blocks until owner has the robot, raises RobotBusy if that
+    # takes longer than timeout seconds
+    def acquire(self, serial, owner, priority='normal', timeout=None):
+        with self.condition:
+            slot = self.slots.setdefault(serial, RobotSlot())
+            waiter = (priorities[priority], next(self.sequence), owner)
+            heapq.heappush(slot.waiters, waiter)
+
+            try:
+                granted = self.condition.wait_for(
+                    lambda: self.can_grant(slot, waiter), timeout)
+
+            finally:
+                slot.waiters.remove(waiter)
+                heapq.heapify(slot.waiters)
+
+            if not granted:
+                # the next in line may be waiting behind this one
+                self.condition.notify_all()
+                raise RobotBusy(serial, slot.owner)
+
+            slot.owner = owner
+            slot.count += 1
+
+            # other claims by the same owner can be granted now too
+            self.condition.notify_all()
+
+    # the caller holds the condition
+    def can_grant(self, slot, waiter):
+        if slot.owner is not None:
+            return slot.owner == waiter[2]
+        return slot.waiters[0] == waiter
+
+    def release(self, serial, owner):
+        with self.condition:
+            slot = self.slots.get(serial)
+            if slot is None or slot.owner != owner:
+                return
+
+            slot.count -= 1
+            if slot.count <= 0:
+                slot.owner = None
+                slot.count = 0
+                self.condition.notify_all()
+
+    # claim(): use as "with robot_scheduler.claim(serial, owner):"
+    @contextmanager
+    def claim(self, serial, owner, priority='normal', timeout=None):
+        self.acquire(serial, owner, priority, timeout)
+        try:
+            yield
+
+        finally:
+            self.release(serial, owner)
+
+    # the owner that has serial right now, or None
+    def owner(self, serial):
+        with self.condition:
+            slot = self.slots.get(serial)
+            return slot.owner if slot else None
+
+    # how many claims are waiting for serial
+    def waiting(self, serial):
+        with self.condition:
+            slot = self.slots.get(serial)
+            return len(slot.waiters) if slot else 0
+
+
+robot_scheduler = RobotScheduler()
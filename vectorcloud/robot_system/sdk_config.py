@@ -0,0 +1,118 @@
+#!/usr/bin/env python3
+
+import os
+import stat
+import tempfile
+import threading
+from pathlib import Path
+from collections import namedtuple
+from configparser import ConfigParser
+
+
+# one robot from sdk_config.ini, the section name is the robot's serial
+RobotProfile = namedtuple('RobotProfile', ['serial', 'ip', 'name', 'cert'])
+
+
+def default_config_file():
+    return os.path.join(Path.home(), '.anki_vector', 'sdk_config.ini')
+
+
+# ------------------------------------------------------------------------------
+# SDK config service
+# ------------------------------------------------------------------------------
+
+# reads the sdk config file written by anki_vector.configure. The file is only
+# parsed again when its mtime or size changes, so profiles() is cheap enough to
+# call on every poll. Every parse uses its own ConfigParser and the cached
+# profiles are immutable, so it is safe to share between threads.
+class SDKConfig:
+
+    def __init__(self, config_file=None):
+        self.config_file = config_file or default_config_file()
+        self.lock = threading.Lock()
+        self.signature = None
+        self.cached_profiles = ()
+
+    def file_signature(self):
+        try:
+            file_stat = os.stat(self.config_file)
+
+        except FileNotFoundError:
+            return None
+
+        return (file_stat.st_mtime_ns, file_stat.st_size)
+
+    def parse(self):
+        config = ConfigParser()
+        config.read(self.config_file)
+        return config
+
+    # every robot in the config file, in the order they appear in it. An
+    # empty tuple if the file doesn't exist.
+    def profiles(self):
+        signature = self.file_signature()
+
+        with self.lock:
+            if signature != self.signature:
+                profiles = []
+
+                if signature is not None:
+                    config = self.parse()
+                    for serial in config.sections():
+                        section = config[serial]
+                        profiles.append(RobotProfile(serial=serial,
+                                                     ip=section.get('ip'),
+                                                     name=section.get('name'),
+                                                     cert=section.get('cert')))
+
+                self.cached_profiles = tuple(profiles)
+                self.signature = signature
+
+            return self.cached_profiles
+
+    # the robot in the first section, which is the one the SDK connects to when
+    # it isn't given a serial. None if there are no robots configured.
+    def default_profile(self):
+        profiles = self.profiles()
+        if profiles:
+            return profiles[0]
+        return None
+
+    def get(self, serial):
+        for profile in self.profiles():
+            if profile.serial == serial:
+                return profile
+        return None
+
+    # update(): changes one robot's settings, e.g. update(serial, ip='...').
+    # The new file is written next to the old one and moved over it, so a
+    # reader never sees a half written config.
+    def update(self, serial, **values):
+        with self.lock:
+            config = self.parse()
+
+            for key, value in values.items():
+                config.set(serial, key, value)
+
+            config_folder = os.path.dirname(self.config_file)
+            fd, temp_file = tempfile.mkstemp(dir=config_folder,
+                                             prefix='.sdk_config.',
+                                             suffix='.tmp')
+            try:
+                with os.fdopen(fd, 'w') as configfile:
+                    config.write(configfile)
+
+                # the file holds the robot's guid, keep its permissions
+                mode = stat.S_IMODE(os.stat(self.config_file).st_mode)
+                os.chmod(temp_file, mode)
+                os.replace(temp_file, self.config_file)
+
+            except BaseException:
+                os.remove(temp_file)
+                raise
+
+            # force the next read to pick up the new file
+            self.signature = None
+
+
+sdk_config = SDKConfig()
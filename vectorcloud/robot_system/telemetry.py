@@ -0,0 +1,141 @@
+#!/usr/bin/env python3
+
+import time
+from sqlalchemy import func, cast, Integer
+from vectorcloud import app, db
+from vectorcloud.models import StatusHistory, StatusRollup
+
+
+# the StatusHistory columns that get rolled up into min/max/avg buckets
+metrics = ['battery_voltage', 'battery_level', 'status_charging',
+           'cube_battery_level', 'cube_battery_volts']
+
+
+# ------------------------------------------------------------------------------
+# Recording
+# ------------------------------------------------------------------------------
+
+# adds a copy of a freshly polled Status row to the history table. The caller
+# commits.
+def record_sample(status):
+    sample = StatusHistory(serial=status.serial,
+                           timestamp=status.timestamp,
+                           version=status.version,
+                           battery_voltage=status.battery_voltage,
+                           battery_level=status.battery_level,
+                           status_charging=status.status_charging,
+                           cube_battery_level=status.cube_battery_level,
+                           cube_battery_volts=status.cube_battery_volts)
+    db.session.add(sample)
+
+
+# compact(): rolls raw samples older than TELEMETRY_RAW_RETENTION up into
+# TELEMETRY_BUCKET_SECONDS wide buckets, deletes them, and drops buckets older
+# than TELEMETRY_ROLLUP_RETENTION. The grouping is done by sqlite so only the
+# rows that just aged out are read, which keeps this cheap enough to run after
+# every poll.
+def compact(now=None):
+    if now is None:
+        now = time.time()
+
+    bucket_seconds = app.config['TELEMETRY_BUCKET_SECONDS']
+
+    # only whole buckets are rolled up, so a bucket never has to be merged
+    # with one written by an earlier pass
+    cutoff = now - app.config['TELEMETRY_RAW_RETENTION']
+    cutoff -= cutoff % bucket_seconds
+
+    bucket = cast(StatusHistory.timestamp / bucket_seconds, Integer)
+    columns = [StatusHistory.serial, bucket]
+    for metric in metrics:
+        column = getattr(StatusHistory, metric)
+        columns += [func.count(column), func.min(column),
+                    func.max(column), func.avg(column)]
+
+    rows = db.session.query(*columns).\
+        filter(StatusHistory.timestamp < cutoff).\
+        group_by(StatusHistory.serial, bucket).all()
+
+    for row in rows:
+        serial = row[0]
+        bucket_start = row[1] * bucket_seconds
+
+        for i, metric in enumerate(metrics):
+            count, minimum, maximum, average = row[2 + i * 4:6 + i * 4]
+
+            # nothing was reported for this metric in this bucket
+            if count == 0:
+                continue
+
+            rollup = StatusRollup(serial=serial,
+                                  metric=metric,
+                                  bucket_start=bucket_start,
+                                  bucket_seconds=bucket_seconds,
+                                  count=count,
+                                  minimum=minimum,
+                                  maximum=maximum,
+                                  average=average)
+            db.session.add(rollup)
+
+    db.session.query(StatusHistory).\
+        filter(StatusHistory.timestamp < cutoff).delete()
+
+    rollup_cutoff = now - app.config['TELEMETRY_ROLLUP_RETENTION']
+    db.session.query(StatusRollup).\
+        filter(StatusRollup.bucket_start < rollup_cutoff).delete()
+
+    db.session.commit()
+
+
+# ------------------------------------------------------------------------------
+# Range queries
+# ------------------------------------------------------------------------------
+
+# history(): everything known about the requested metrics of one robot
+# between start and end (unix timestamps), oldest first. Recent data comes
+# back as raw samples, anything that has already been compacted comes back as
+# buckets. Both tables are filtered on indexed columns so only the requested
+# window is read.
+def history(serial, start, end=None, metric_names=None):
+    if end is None:
+        end = time.time()
+
+    if metric_names is None:
+        metric_names = metrics
+
+    samples = StatusHistory.query.\
+        filter(StatusHistory.serial == serial,
+               StatusHistory.timestamp >= start,
+               StatusHistory.timestamp <= end).\
+        order_by(StatusHistory.timestamp).all()
+
+    # a bucket that starts before the window can still overlap it
+    earliest_bucket = start - app.config['TELEMETRY_BUCKET_SECONDS']
+    rollups = StatusRollup.query.\
+        filter(StatusRollup.serial == serial,
+               StatusRollup.metric.in_(metric_names),
+               StatusRollup.bucket_start > earliest_bucket,
+               StatusRollup.bucket_start <= end).\
+        order_by(StatusRollup.bucket_start).all()
+
+    results = {'serial': serial, 'start': start, 'end': end, 'metrics': {}}
+
+    for metric in metric_names:
+        results['metrics'][metric] = {
+            'samples': [[sample.timestamp, getattr(sample, metric)]
+                        for sample in samples],
+            'buckets': []}
+
+    for rollup in rollups:
+        if rollup.bucket_start + rollup.bucket_seconds <= start:
+            continue
+
+        results['metrics'][rollup.metric]['buckets'].append({
+            'start': rollup.bucket_start,
+            'seconds': rollup.bucket_seconds,
+            'count': rollup.count,
+            'min': rollup.minimum,
+            'max': rollup.maximum,
+            'avg': rollup.average})
+
+    return results
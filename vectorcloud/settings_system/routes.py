@@ -4,8 +4,8 @@ from flask import render_template, url_for, redirect, flash, request, Blueprint
 from flask_login import current_user
 from vectorcloud.user_system.forms import RegisterForm
 from vectorcloud.settings_system.forms import SettingsForms
-from vectorcloud.models import User, Status, Settings
-from vectorcloud.main.utils import get_stats
+from vectorcloud.models import User, Settings
+from vectorcloud.main.utils import get_stats, current_status
 from vectorcloud.main.routes import sdk_version
 from vectorcloud import db, bcrypt
 
@@ -51,7 +51,7 @@ def settings():
     if err_msg:
         return redirect(url_for('error_pages.' + err_msg))
 
-    vector_status = Status.query.first()
+    vector_status = current_status()
     return render_template('settings/main.html', form=form,
                            vector_status=vector_status,
                            sdk_version=sdk_version)
@@ -78,7 +78,7 @@ def settings_user():
     if err_msg:
         return redirect(url_for('error_pages.' + err_msg))
 
-    vector_status = Status.query.first()
+    vector_status = current_status()
     return render_template('settings/user.html', form=form,
                            vector_status=vector_status,
                            user_form=user_form,
@@ -10,3 +10,40 @@ $(document).ready(function(){
 $('.popover-dismiss').popover({
   trigger: 'focus'
 })
+
+
+// while Vector is working through queued jobs (dock, undock, commands...) list
+// them above the page, and reload once they are all finished so their output
+// gets flashed.
+function pollJobs(wasBusy){
+    var xhr = new XMLHttpRequest();
+    xhr.onreadystatechange = function() {
+        if (xhr.readyState == XMLHttpRequest.DONE && xhr.status == 200) {
+            var active = JSON.parse(xhr.responseText).active;
+
+            if (active.length > 0) {
+                var text = "";
+                for (var i = 0; i < active.length; i++) {
+                    text += active[i].name + ": " + active[i].state;
+                    if (active[i].total) {
+                        text += " (" + active[i].done + "/" + active[i].total + ")";
+                    }
+                    text += "<br>";
+                }
+                $("#jobs").html(text).show();
+                setTimeout(function() { pollJobs(true) }, 1000);
+            }
+            else if (wasBusy) {
+                location.reload();
+            }
+        }
+    }
+    xhr.open("GET", "/jobs", true);
+    xhr.send();
+}
+
+$(document).ready(function(){
+    if ($("#jobs").length) {
+        pollJobs(false);
+    }
+});
@@ -3,6 +3,7 @@
 import anki_vector
 from vectorcloud.models import Settings, User
 from vectorcloud import db
+from vectorcloud.robot_system.connection import connection_manager, resolve
 
 
 # this makes Vector greet you when you log in from the login page
@@ -18,10 +19,9 @@ def login_message():
 
             else:
                 robot_msg = settings.custom_greeting_message
-            args = anki_vector.util.parse_command_args()
-            with anki_vector.Robot(args.serial) as robot:
-                robot.behavior.set_eye_color(hue=0.0, saturation=0.0)
-                robot.say_text(robot_msg)
+            with connection_manager.lease(priority='high') as robot:
+                resolve(robot.behavior.set_eye_color(hue=0.0, saturation=0.0))
+                resolve(robot.say_text(robot_msg))
 
     except anki_vector.exceptions.VectorNotFoundException:
         return 'vector_not_found'